@@ -43,11 +43,37 @@ __contributors__ = {}
 
 __url__ = ''
 
+from . import events
+from . import filters
 from . import config
+from . import admission
+from . import api
+from . import coalesce
+from . import projects
+from . import profiling
+from . import receiver
+from . import scheduler
+from . import shard
+from . import spool
+from . import stats
+from . import store
 from . import plugin
 from imp import reload
 # In case we're being reloaded.
+reload(events)
+reload(filters)
 reload(config)
+reload(admission)
+reload(api)
+reload(coalesce)
+reload(projects)
+reload(profiling)
+reload(receiver)
+reload(scheduler)
+reload(shard)
+reload(spool)
+reload(stats)
+reload(store)
 reload(plugin)
 # Add more reloads here if you add third-party modules and want them to be
 # reloaded when this plugin is reloaded.  Don't forget to import them as well!
@@ -0,0 +1,108 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import time
+import threading
+import collections
+
+
+class RateLimiter(object):
+    """Token buckets of <burst> requests refilled at <rate> requests per
+    second, kept for the <size> most recently seen keys"""
+
+    def __init__(self, rate, burst, size=10000):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()
+
+    def check(self, key):
+        """Takes a token of <key>'s bucket, returns 0 if there was one or
+        else the number of seconds until there is one"""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst,
+                             bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionControl(object):
+    """Decides whether a webhook request is handled, before its body is
+    read or verified"""
+
+    def __init__(self, max_body_size, max_in_flight, address_limiter,
+                 channel_limiter):
+        self.max_body_size = max_body_size
+        self.max_in_flight = max_in_flight
+        self.address_limiter = address_limiter
+        self.channel_limiter = channel_limiter
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def admit(self, length, address, channel):
+        """Returns None and counts the request as in flight if it is
+        admitted, else the reason it is not and the number of seconds after
+        which it may be retried"""
+        if length > self.max_body_size:
+            return ('too-large', None)
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                return ('overloaded', 1)
+            self.in_flight += 1
+        for (limiter, key) in ((self.address_limiter, address),
+                               (self.channel_limiter, channel)):
+            wait = limiter.check(key) if key is not None else 0
+            if wait:
+                self.release()
+                return ('rate-limited', wait)
+        return None
+
+    def release(self):
+        """Counts an admitted request as done"""
+        with self._lock:
+            self.in_flight -= 1
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
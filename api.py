@@ -0,0 +1,273 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import json
+import time
+import threading
+import collections
+import http.client
+import urllib.parse
+import concurrent.futures
+
+import supybot.log as log
+
+# Marks lookups that failed, they are cached for a shorter time
+_MISSING = object()
+
+# Payload types that have statuses, and the resources listing them
+STATUS_RESOURCES = {
+    'userstory': 'userstory-statuses',
+    'task': 'task-statuses',
+    'issue': 'issue-statuses',
+}
+
+
+def api_url(project_url):
+    """Returns the API root of the Taiga instance hosting <project_url>,
+    e.g. https://taiga.example.com/api/v1 for
+    https://taiga.example.com/project/example"""
+    parts = urllib.parse.urlsplit(project_url)
+    (prefix, _sep, _slug) = parts.path.partition('/project/')
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc,
+                                    prefix.rstrip('/') + '/api/v1', '', ''))
+
+
+class ConnectionPool(object):
+    """Keeps up to <size> idle keep-alive connections per host"""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def request(self, method, url, body=None, headers=None):
+        """Sends a request and returns the status and the body of the
+        response. Raises on connection errors."""
+        parts = urllib.parse.urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(('', '', parts.path, parts.query, ''))
+
+        # An idle connection may have been closed by the server in the
+        # meantime, the others then likely were too: they are dropped and
+        # the request is sent again on a new connection
+        for reuse in (True, False):
+            connection = None
+            if reuse:
+                with self._lock:
+                    idle = self._idle[host]
+                    connection = idle.pop() if idle else None
+            reused = connection is not None
+            if connection is None:
+                connection = self._connect(*host)
+            try:
+                connection.request(method, path, body, headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused:
+                    self._drop(host)
+                    continue
+                raise
+            self._release(host, connection, response)
+            return (response.status, data)
+
+    def get_json(self, url, headers=None):
+        """Returns the decoded JSON document at <url>, or None if it does
+        not exist. Raises on other errors."""
+        headers = dict(headers or {}, Accept='application/json')
+        (status, body) = self.request('GET', url, headers=headers)
+        if status == 404:
+            return None
+        if status != 200:
+            raise http.client.HTTPException('%s: HTTP %i' % (url, status))
+        return json.loads(body.decode('utf-8'))
+
+    def _release(self, host, connection, response):
+        if response.will_close:
+            connection.close()
+            return
+        with self._lock:
+            idle = self._idle[host]
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _drop(self, host):
+        with self._lock:
+            connections = self._idle.pop(host, [])
+        for connection in connections:
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            connections = [connection for idle in self._idle.values()
+                           for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+class LookupCache(object):
+    """Remembers looked up values for <ttl> seconds and failed lookups for
+    <negative_ttl> seconds, evicting the least recently used ones beyond
+    <size> entries"""
+
+    def __init__(self, ttl, negative_ttl, size):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns (found, value), value being None for a cached failure"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return (False, None)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return (True, None if entry[1] is _MISSING else entry[1])
+
+    def put(self, key, value):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.time() + ttl,
+                                  _MISSING if value is None else value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TaigaApi(object):
+    """Looks up the names of projects, statuses and users on the Taiga
+    instances in a pool of <workers> threads. Concurrent lookups of the same
+    resource share a single request."""
+
+    def __init__(self, pool, cache, workers, token=None):
+        self.pool = pool
+        self.cache = cache
+        self.token = token
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix='Taiga API')
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def stop(self):
+        self._executor.shutdown(wait=False)
+        self.pool.close()
+
+    def lookup(self, url, field):
+        """Returns a future of the <field> of the document at <url>"""
+        key = (url, field)
+        (found, value) = self.cache.get(key)
+        if found:
+            future = concurrent.futures.Future()
+            future.set_result(value)
+            return future
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._executor.submit(self._fetch, url, field)
+                self._inflight[key] = future
+        return future
+
+    def _headers(self):
+        if self.token:
+            return {'Authorization': 'Bearer ' + self.token}
+        return None
+
+    def _fetch(self, url, field):
+        try:
+            document = self.pool.get_json(url, self._headers())
+            value = document.get(field) if isinstance(document, dict) \
+                else None
+            self.cache.put((url, field), value)
+            return value
+        except Exception as e:
+            log.info('Taiga: Could not look up %s: %s', url, e)
+            self.cache.put((url, field), None)
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop((url, field), None)
+
+    def project_name(self, project_url, project_id):
+        return self.lookup('%s/projects/%s' % (api_url(project_url),
+                                               project_id), 'name')
+
+    def status_name(self, project_url, payload_type, status_id):
+        return self.lookup('%s/%s/%s' % (api_url(project_url),
+                                         STATUS_RESOURCES[payload_type],
+                                         status_id), 'name')
+
+    def user_name(self, project_url, user_id):
+        return self.lookup('%s/users/%s' % (api_url(project_url), user_id),
+                           'full_name_display')
+
+    def prefetch(self, project_url, project_id):
+        """Warms the cache with the name and statuses of a project"""
+        self.project_name(project_url, project_id)
+        self._executor.submit(self._prefetch_statuses, project_url,
+                              project_id)
+
+    def _prefetch_statuses(self, project_url, project_id):
+        root = api_url(project_url)
+        for resource in STATUS_RESOURCES.values():
+            url = '%s/%s?project=%s' % (root, resource, project_id)
+            try:
+                statuses = self.pool.get_json(url, self._headers())
+            except Exception as e:
+                log.info('Taiga: Could not look up %s: %s', url, e)
+                continue
+            for status in statuses or ():
+                if isinstance(status, dict) and 'id' in status:
+                    self.cache.put(('%s/%s/%s' % (root, resource,
+                                                  status['id']), 'name'),
+                                   status.get('name'))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,352 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+"""
+Offline benchmark of the webhook pipeline: synthetic Taiga payloads are
+replayed through TaigaWebHookService.doPost into a stubbed Irc.
+
+It runs as part of the test suite when TAIGA_BENCHMARK is set:
+
+    TAIGA_BENCHMARK=1 supybot-test plugins/Taiga
+
+and fails if the number of messages or the allocations per event differ
+from bench_baseline.json by more than their tolerance. Timings depend on
+the machine and its load, so they only fail on a gross slowdown: half the
+events per second or twice the median latency of the baseline. Set
+TAIGA_BENCHMARK_UPDATE=1 to store the results as the new baseline instead.
+"""
+
+import io
+import gc
+import hmac
+import json
+import time
+import random
+import hashlib
+import tracemalloc
+
+import supybot.conf as conf
+import supybot.world as world
+import supybot.ircutils as ircutils
+
+from .config import PAYLOAD_TYPES
+
+ACTIONS = ('create', 'change', 'delete')
+STATUSES = ('New', 'Ready', 'In progress', 'Ready for test', 'Done')
+USERS = [{'id': i, 'name': name, 'username': name.lower()}
+         for (i, name) in enumerate(('Alice', 'Bob', 'Carol', 'Dave'), 1)]
+
+
+class FakeHandler(object):
+    """Stands in for the request handler of supybot's HTTP server"""
+
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+        self.wfile = io.BytesIO()
+        self.response = None
+        self.sent_headers = {}
+
+    def send_response(self, code):
+        self.response = code
+
+    def send_header(self, name, value):
+        self.sent_headers[name] = value
+
+    def end_headers(self):
+        pass
+
+
+class StubIrc(object):
+    """An Irc that is joined to <channels> and only counts the messages
+    queued to it"""
+
+    class State(object):
+        def __init__(self, channels):
+            self.channels = ircutils.IrcDict((channel, None)
+                                             for channel in channels)
+            self.supported = ircutils.IrcDict()
+
+    def __init__(self, network, channels):
+        self.network = network
+        self.nick = 'bench'
+        self.zombie = False
+        self.state = self.State(channels)
+        self.queued = 0
+
+    def queueMsg(self, msg):
+        self.queued += 1
+
+
+def sign(body, key='XXXXXXXX'):
+    return hmac.new(key.encode('utf-8'), msg=body,
+                    digestmod=hashlib.sha1).hexdigest()
+
+
+def post(service, payload, path='/test/test', headers=None):
+    """Sends <payload> (a dict or a body) to <service> like Taiga does and
+    returns the handler holding the response"""
+    body = payload if isinstance(payload, bytes) else \
+        json.dumps(payload).encode('utf-8')
+    if headers is None:
+        headers = {'X-TAIGA-WEBHOOK-SIGNATURE': sign(body)}
+    handler = FakeHandler(headers)
+    service.doPost(handler, path, body)
+    return handler
+
+
+def _change(rng, user):
+    diff = {}
+    if rng.random() < 0.7:
+        (old, new) = rng.sample(STATUSES, 2)
+        diff['status'] = {'from': old, 'to': new}
+    if rng.random() < 0.4:
+        diff['assigned_to'] = {'from': None,
+                               'to': rng.choice(USERS)['username']}
+    if rng.random() < 0.3 or not diff:
+        diff['description_diff'] = '<p>' + 'Lorem ipsum ' * 20 + '</p>'
+    return {
+        'comment': rng.choice(['', 'Looks good to me', 'See the attached '
+                               'logs, this fails on every second run']),
+        'comment_html': '',
+        'date': '2026-01-01T12:00:00.000Z',
+        'diff': diff,
+        'user': user,
+    }
+
+
+def generate_payloads(count, project_ids, seed=0):
+    """Returns <count> payloads cycling through all payload types and
+    actions, spread over <project_ids>"""
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        payload_type = PAYLOAD_TYPES[i % len(PAYLOAD_TYPES)]
+        action = ACTIONS[(i // len(PAYLOAD_TYPES)) % len(ACTIONS)]
+        owner = rng.choice(USERS)
+        data = {
+            'id': i,
+            'ref': i + 1,
+            'project': rng.choice(project_ids),
+            'owner': owner,
+            'subject': 'Item %i: %s' % (i, ' '.join(rng.sample(
+                ['fix', 'login', 'page', 'slow', 'export', 'report', 'api',
+                 'crash', 'when', 'saving'], 4))),
+            'description': 'Lorem ipsum dolor sit amet. ' * 10,
+            'tags': rng.sample(['backend', 'frontend', 'urgent', 'ux'], 2),
+            'assigned_to': rng.choice(USERS + [None]),
+            'created_date': '2026-01-01T12:00:00.000Z',
+            'modified_date': '2026-01-01T12:00:00.000Z',
+            'is_closed': False,
+            'version': rng.randint(1, 20),
+            'watchers': [user['id'] for user in USERS],
+        }
+        if payload_type == 'milestone':
+            data.update(name='Sprint %i' % i, slug='sprint-%i' % i,
+                        estimated_start='2026-01-01',
+                        estimated_finish='2026-01-14')
+        elif payload_type == 'wikipage':
+            data.update(slug='page-%i' % i, name='Page %i' % i,
+                        content='# Page\n' + 'Some content. ' * 30)
+        elif payload_type == 'task':
+            data['user_story'] = {'id': i // 10, 'ref': i // 10 + 1,
+                                  'subject': 'Parent story'}
+        elif payload_type == 'userstory':
+            data['milestone'] = {'id': i // 20, 'name': 'Sprint %i' % (i // 20)}
+            data['points'] = {'1': 3, '2': 5}
+        payload = {
+            'type': payload_type,
+            'action': action,
+            'by': owner,
+            'date': '2026-01-01T12:00:%02i.%06iZ' % (i % 60, i),
+            'data': data,
+        }
+        if action == 'change':
+            payload['change'] = _change(rng, rng.choice(USERS))
+        payloads.append(payload)
+    return payloads
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_benchmark(plugin, events=2000, channels=200, projects=50,
+                  subscriptions=3, seed=0):
+    """Replays <events> payloads through the webhook service of <plugin>
+    into a StubIrc joined to <channels> channels, where each of <projects>
+    projects is subscribed in <subscriptions> channels. Returns the
+    results as a dict."""
+    rng = random.Random(seed)
+    channel_names = ['#bench%i' % i for i in range(channels)]
+    project_ids = [str(1000 + i) for i in range(projects)]
+    mappings = {}
+    for project_id in project_ids:
+        for channel in rng.sample(channel_names,
+                                  min(subscriptions, channels)):
+            mappings.setdefault(channel, {})[project_id] = {
+                'slug': 'project-%s' % project_id,
+                'url': 'https://taiga.example.com/project/project-%s' %
+                       project_id,
+            }
+
+    irc = StubIrc('bench', channel_names)
+    path = '/bench/' + channel_names[0][1:]
+    bodies = []
+    for payload in generate_payloads(events, project_ids, seed):
+        body = json.dumps(payload).encode('utf-8')
+        bodies.append((body, {'X-TAIGA-WEBHOOK-SIGNATURE': sign(body)}))
+
+    service = plugin._service
+    group = conf.supybot.plugins.Taiga
+    (workers, ttl) = (plugin._queue.workers, plugin._dedup.ttl)
+    limiter = plugin._admission.channel_limiter
+    rate = limiter.rate
+    world.ircs.append(irc)
+    try:
+        for (channel, projects_mapping) in mappings.items():
+            plugin._save_projects(projects_mapping, channel)
+        # Measure the pipeline, not the throttling
+        with group.throttle.rate.context(1e9), \
+                group.throttle.burst.context(10 ** 9), \
+                group.throttle.backlog.context(10 ** 9):
+            plugin._queue.workers = 0
+            plugin._dedup.ttl = 0
+            limiter.rate = 0
+            # Warm up the caches
+            for (body, headers) in bodies[:50]:
+                service.doPost(FakeHandler(headers), path, body)
+
+            latencies = []
+            queued = irc.queued
+            gc.collect()
+            start = time.perf_counter()
+            for (body, headers) in bodies:
+                before = time.perf_counter()
+                service.doPost(FakeHandler(headers), path, body)
+                latencies.append(time.perf_counter() - before)
+            elapsed = time.perf_counter() - start
+            queued = irc.queued - queued
+
+            # Tracing slows everything down, measure allocations apart
+            sample = bodies[:min(len(bodies), 500)]
+            allocated = 0
+            tracemalloc.start()
+            try:
+                for (body, headers) in sample:
+                    handler = FakeHandler(headers)
+                    (current, peak) = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    service.doPost(handler, path, body)
+                    allocated += tracemalloc.get_traced_memory()[1] - current
+            finally:
+                tracemalloc.stop()
+    finally:
+        plugin._queue.workers = workers
+        plugin._dedup.ttl = ttl
+        limiter.rate = rate
+        for channel in mappings:
+            plugin._save_projects({}, channel)
+        world.ircs.remove(irc)
+        irc.zombie = True
+
+    return {
+        'events': events,
+        'channels': channels,
+        'projects': projects,
+        'messages': queued,
+        'events_per_second': events / elapsed,
+        'p50_ms': _percentile(latencies, 0.5) * 1000,
+        'p99_ms': _percentile(latencies, 0.99) * 1000,
+        'alloc_bytes_per_event': allocated / len(sample),
+    }
+
+
+def format_results(results):
+    return ('%(events)i events into %(channels)i channels '
+            '(%(messages)i messages): %(events_per_second).0f events/s, '
+            'p50 %(p50_ms).3fms, p99 %(p99_ms).3fms, '
+            '%(alloc_bytes_per_event).0f bytes allocated per event' % results)
+
+
+# Metrics that do not depend on the speed of the machine, and how much
+# they may grow from the baseline
+GATED_METRICS = (('messages', 0.0), ('alloc_bytes_per_event', 0.25))
+
+# Timings, whether higher is better, and the lowest ratio to the baseline
+# they may fall to, None for those that are too noisy and only reported
+TIMED_METRICS = (('events_per_second', True, 0.5), ('p50_ms', False, 0.5),
+                 ('p99_ms', False, None))
+
+
+def compare_baseline(results, baseline):
+    """Returns the list of gated metrics and timings of <results> that
+    regressed from <baseline> by more than their tolerance"""
+    regressions = []
+    for (metric, tolerance) in GATED_METRICS:
+        if metric not in baseline:
+            continue
+        if metric == 'messages':
+            # Deterministic, any change is a change of behavior
+            regressed = results[metric] != baseline[metric]
+        else:
+            regressed = results[metric] > baseline[metric] * (1 + tolerance)
+        if regressed:
+            regressions.append('%s: %.3f (baseline %.3f)' %
+                               (metric, results[metric], baseline[metric]))
+    for (metric, higher_is_better, lowest) in TIMED_METRICS:
+        if lowest is None or metric not in baseline or not results[metric]:
+            continue
+        if _ratio(results, baseline, metric, higher_is_better) < lowest:
+            regressions.append('%s: %.3f (baseline %.3f)' %
+                               (metric, results[metric], baseline[metric]))
+    return regressions
+
+
+def _ratio(results, baseline, metric, higher_is_better):
+    ratio = results[metric] / baseline[metric]
+    if not higher_is_better:
+        ratio = 1 / ratio
+    return ratio
+
+
+def compare_timings(results, baseline):
+    """Returns the timings of <results> relative to <baseline>, above 1 if
+    they are better"""
+    ratios = []
+    for (metric, higher_is_better, lowest) in TIMED_METRICS:
+        if metric not in baseline or not results[metric]:
+            continue
+        ratios.append('%s %.2fx' % (metric, _ratio(results, baseline, metric,
+                                                   higher_is_better)))
+    return ', '.join(ratios)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,178 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import time
+import threading
+
+import supybot.schedule as schedule
+try:
+    from supybot.i18n import PluginInternationalization
+    _ = PluginInternationalization('Taiga')
+except ImportError:
+    # Placeholder that allows to run the plugin on a bot
+    # without the i18n module
+    def _(x):
+        return x
+
+
+KINDS = {
+    'milestone': (_('Milestone'), _('milestones')),
+    'userstory': (_('Userstory'), _('userstories')),
+    'task': (_('Task'), _('tasks')),
+    'issue': (_('Issue'), _('issues')),
+    'wikipage': (_('Wikipage'), _('wikipages')),
+}
+
+
+def _reference(value, key):
+    """Taiga sends related objects either as an id or as a dict"""
+    if isinstance(value, dict):
+        return value.get(key, value.get('id'))
+    return value
+
+
+def _item(payload_type, payload_data):
+    if payload_type == 'milestone':
+        return {'ref': payload_data.get('id'),
+                'subject': payload_data.get('name', '')}
+    elif payload_type == 'wikipage':
+        return {'ref': payload_data.get('slug'),
+                'subject': payload_data.get('name', '')}
+    else:
+        return {'ref': payload_data.get('ref'),
+                'subject': payload_data.get('subject', '')}
+
+
+def _parent(payload_type, payload_data):
+    if payload_type == 'task' and payload_data.get('user_story'):
+        return _(' in US #%s') % _reference(payload_data['user_story'], 'ref')
+    elif payload_type == 'userstory' and payload_data.get('milestone'):
+        return _(' in milestone %s') % \
+            _reference(payload_data['milestone'], 'name')
+    return ''
+
+
+class Coalescer(object):
+    """Merges the notifications that arrive within a channel's coalescing
+    window: the changes of an item become a single announcement, and so do
+    the items created in the same parent"""
+
+    def __init__(self, send):
+        self.send = send
+        self._lock = threading.Lock()
+        self._groups = {}
+        self._counter = 0
+
+    def add(self, channel, window, payload_type, payload_action,
+            format_string_identifier, args):
+        payload_data = args[payload_type]
+        project_id = args['project']['id']
+        if payload_action == 'change':
+            key = ('change', project_id, payload_type, payload_data.get('id'))
+        elif payload_action == 'create':
+            key = ('create', project_id, payload_type,
+                   _parent(payload_type, payload_data))
+        else:
+            # Announce pending changes of the item before it is deleted
+            self.flush(channel, ('change', project_id, payload_type,
+                                 payload_data.get('id')))
+            self.send(channel, format_string_identifier, args)
+            return
+
+        with self._lock:
+            group = self._groups.get((channel, key))
+            if group is None:
+                self._counter += 1
+                name = 'Taiga coalesce #%i' % self._counter
+                group = self._groups[(channel, key)] = (name, [])
+                schedule.addEvent(self._flush, time.time() + window, name,
+                                  args=[channel, key])
+            group[1].append((format_string_identifier, args))
+
+    def flush(self, channel, key):
+        """Announces the pending notifications of <key> in <channel> right
+        away"""
+        with self._lock:
+            group = self._groups.get((channel, key))
+            if group is None:
+                return
+            self._remove_event(group[0])
+        self._flush(channel, key)
+
+    def flush_all(self):
+        with self._lock:
+            keys = list(self._groups)
+            for (channel, key) in keys:
+                self._remove_event(self._groups[(channel, key)][0])
+        for (channel, key) in keys:
+            self._flush(channel, key)
+
+    def _remove_event(self, name):
+        try:
+            schedule.removeEvent(name)
+        except KeyError:
+            # The event is already running
+            pass
+
+    def _flush(self, channel, key):
+        with self._lock:
+            group = self._groups.pop((channel, key), None)
+        if group is None:
+            return
+        entries = group[1]
+        if len(entries) == 1:
+            self.send(channel, *entries[0])
+            return
+
+        payload_type = key[2]
+        users = []
+        for (format_string_identifier, args) in entries:
+            name = args['user'].get('name')
+            if name not in users:
+                users.append(name)
+        (first_args, last_args) = (entries[0][1], entries[-1][1])
+        digest = {
+            'project': last_args['project'],
+            'kind': KINDS[payload_type][0],
+            'kinds': KINDS[payload_type][1],
+            'item': _item(payload_type, last_args[payload_type]),
+            'parent': _parent(payload_type, first_args[payload_type]),
+            'count': len(entries),
+            'users': ', '.join(str(user) for user in users),
+        }
+        if key[0] == 'change':
+            digest['url'] = last_args['url']
+            self.send(channel, 'format.digest-changed', digest)
+        else:
+            digest['url'] = last_args['project']['url']
+            self.send(channel, 'format.digest-created', digest)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
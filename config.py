@@ -28,8 +28,12 @@
 
 ###
 
+import re
+import string
+
 import supybot.conf as conf
 import supybot.registry as registry
+from .filters import EventFilter
 try:
     from supybot.i18n import PluginInternationalization
     _ = PluginInternationalization('Taiga')
@@ -48,6 +52,150 @@ def configure(advanced):
     conf.registerPlugin('Taiga', True)
 
 
+PAYLOAD_TYPES = ('milestone', 'userstory', 'task', 'issue', 'wikipage')
+FORMAT_FIELDS = PAYLOAD_TYPES + ('project', 'user', 'url', 'change')
+DIGEST_FIELDS = ('project', 'kind', 'kinds', 'item', 'parent', 'count',
+                 'users', 'url')
+
+_fieldKeyRe = re.compile(r'\.([^.\[]+)|\[([^\]]+)\]')
+
+
+def parse_format_fields(format_string, allowed=None):
+    """Returns the set of field paths referenced by <format_string>, e.g.
+    ('userstory', 'ref') for '{userstory[ref]}'. Raises ValueError if the
+    string is malformed or references a field that is not in <allowed>."""
+    fields = set()
+    for (_literal, name, _spec, _conversion) in \
+            string.Formatter().parse(format_string):
+        if name is None:
+            continue
+        match = re.match(r'[^.\[]*', name)
+        root = match.group(0)
+        if not root or (allowed is not None and root not in allowed):
+            raise ValueError('Unknown field %r' % (root or name))
+        keys = tuple(a or b for (a, b) in
+                     _fieldKeyRe.findall(name[match.end():]))
+        fields.add((root,) + keys)
+    return fields
+
+
+class _Placeholder(object):
+    """Stands for any value of a payload when test-rendering a format
+    string"""
+
+    def __getitem__(self, key):
+        return self
+
+    def __getattr__(self, name):
+        return self
+
+    def __format__(self, spec):
+        # Payload values are strings or numbers. Supybot replaces the
+        # format() builtin.
+        try:
+            return str.__format__('', spec)
+        except (ValueError, TypeError):
+            return int.__format__(0, spec)
+
+
+class _Placeholders(dict):
+    def __missing__(self, key):
+        return _Placeholder()
+
+
+class FormatString(registry.String):
+    """Value must be a valid format string that only references the fields
+    milestone, userstory, task, issue, wikipage, project, user, url and
+    change."""
+    __slots__ = ()
+    fields = FORMAT_FIELDS
+
+    def setValue(self, v):
+        try:
+            parse_format_fields(v, self.fields)
+            # Catches the conversions and format specs that no value
+            # supports
+            v.format_map(_Placeholders())
+        except (ValueError, TypeError, KeyError, IndexError):
+            self.error(v)
+        registry.String.setValue(self, v)
+
+
+def _format_string(payload_type, action):
+    """Returns the FormatString class of the format of <action> events of
+    <payload_type>, which only allows the fields of these events"""
+    fields = (payload_type, 'project', 'user', 'url')
+    if action == 'changed':
+        fields += ('change',)
+    return type('FormatString', (FormatString,), {
+        '__slots__': (),
+        '__doc__': 'Value must be a valid format string that only references '
+                   'the fields %s and %s.' % (', '.join(fields[:-1]),
+                                              fields[-1]),
+        'fields': fields,
+    })
+
+
+FORMAT_STRINGS = dict(('%s-%s' % (payload_type, action),
+                       _format_string(payload_type, action))
+                      for payload_type in PAYLOAD_TYPES
+                      for action in ('created', 'deleted', 'changed'))
+
+
+class DigestFormatString(FormatString):
+    """Value must be a valid format string that only references the fields
+    project, kind, kinds, item, parent, count, users and url."""
+    __slots__ = ()
+    fields = DIGEST_FIELDS
+
+
+class FilterString(registry.String):
+    """Value must be a list of rules like 'type:issue,task', 'action:create',
+    'changed:status', 'tag:urgent' or 'assignee:alice', optionally prefixed
+    with '-'."""
+    __slots__ = ()
+
+    def setValue(self, v):
+        try:
+            EventFilter(v)
+        except ValueError:
+            self.error(v)
+        registry.String.setValue(self, v)
+
+
+class NonNegativeFloat(registry.Float):
+    """Value must be a floating-point number greater than or equal to
+    zero."""
+    __slots__ = ()
+    errormsg = _('Value must be a floating-point number greater than or '
+                 'equal to zero, not %r.')
+
+    def setValue(self, v):
+        if v < 0:
+            self.error(v)
+        registry.Float.setValue(self, v)
+
+
+class SignatureDigest(registry.OnlySomeStrings):
+    """Valid values are 'sha1', 'sha256', 'sha384' and 'sha512'."""
+    validStrings = ('sha1', 'sha256', 'sha384', 'sha512')
+
+
+class DropPolicy(registry.OnlySomeStrings):
+    """Valid values are 'oldest' and 'newest'."""
+    validStrings = ('oldest', 'newest')
+
+
+class ReceiverMode(registry.OnlySomeStrings):
+    """Valid values are 'httpserver' and 'asyncio'."""
+    validStrings = ('httpserver', 'asyncio')
+
+
+class StoreBackend(registry.OnlySomeStrings):
+    """Valid values are 'registry' and 'sqlite'."""
+    validStrings = ('registry', 'sqlite')
+
+
 Taiga = conf.registerPlugin('Taiga')
 
 # Settings
@@ -60,57 +208,297 @@ conf.registerChannelValue(Taiga, 'secret-key',
 conf.registerChannelValue(Taiga, 'verify-signature',
     registry.Boolean(True, _("""Whether the signature should be checked or not""")))
 
+conf.registerChannelValue(Taiga, 'signature-digest',
+    SignatureDigest('sha1', _("""Digest algorithm of the HMAC signing the
+    notifications. Taiga uses sha1.""")))
+
+conf.registerChannelValue(Taiga, 'filter',
+    FilterString('', _("""Space-separated rules the notifications have to
+    match to be announced in the channel: 'type:' and 'action:' followed by
+    payload types (milestone, userstory, task, issue, wikipage) or actions
+    (create, change, delete), 'changed:' followed by fields of which changes
+    are announced, 'tag:' followed by tags and 'assignee:' followed by user
+    names or ids, or none. A rule lists comma-separated values, any of which
+    has to match, and is inverted by prefixing it with '-'. Empty announces
+    every notification.""")))
+
+conf.registerChannelValue(Taiga, 'coalesce-window',
+    registry.NonNegativeInteger(0, _("""Number of seconds during which the
+    changes of an item, and the items created in the same parent, are merged
+    into a single announcement. 0 announces every notification on its
+    own.""")))
+
+# Throttle
+conf.registerGroup(Taiga, 'throttle')
+
+conf.registerChannelValue(Taiga.throttle, 'rate',
+    registry.PositiveFloat(1.0, _("""Number of announcements per second sent
+    to the channel once its burst is used up.""")))
+
+conf.registerChannelValue(Taiga.throttle, 'burst',
+    registry.PositiveInteger(5, _("""Number of announcements that can be sent
+    to the channel at once.""")))
+
+conf.registerChannelValue(Taiga.throttle, 'backlog',
+    registry.PositiveInteger(20, _("""Number of announcements waiting to be
+    sent to the channel above which they are replaced by a single summary of
+    the suppressed events.""")))
+
+conf.registerGlobalValue(Taiga, 'store',
+    StoreBackend('registry', _("""Where the project mappings are kept:
+    'registry' uses the projects values, 'sqlite' a database in the data
+    directory, which handles many subscriptions better. The mappings of the
+    registry are imported into the database the first time it is used. Takes
+    effect when the plugin is reloaded.""")))
+
+# Receiver
+conf.registerGroup(Taiga, 'receiver')
+
+conf.registerGlobalValue(Taiga.receiver, 'mode',
+    ReceiverMode('httpserver', _("""How webhooks are received: 'httpserver'
+    uses the HTTP server of the bot, at /taiga/, 'asyncio' a server of the
+    plugin on its own port. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.receiver, 'host',
+    registry.String('', _("""Address the server of the plugin listens on,
+    all addresses if empty. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.receiver, 'port',
+    registry.NonNegativeInteger(8093, _("""Port the server of the plugin
+    listens on. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.receiver, 'max-connections',
+    registry.PositiveInteger(1000, _("""Maximum number of connections the
+    server of the plugin serves at once, others wait for their turn. Takes
+    effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.receiver, 'timeout',
+    registry.PositiveInteger(30, _("""Number of seconds after which an idle
+    connection to the server of the plugin is closed. Takes effect when the
+    plugin is reloaded.""")))
+
+# Admission control
+conf.registerGroup(Taiga, 'admission')
+
+conf.registerGlobalValue(Taiga.admission, 'max-body-size',
+    registry.PositiveInteger(1024 * 1024, _("""Maximum size in bytes of a
+    notification, larger ones are rejected. Takes effect when the plugin is
+    reloaded.""")))
+
+conf.registerGlobalValue(Taiga.admission, 'max-in-flight',
+    registry.PositiveInteger(200, _("""Maximum number of webhook requests
+    handled at once, others are answered with a 503 error. Takes effect when
+    the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.admission, 'address-rate',
+    NonNegativeFloat(20.0, _("""Number of requests per second
+    accepted from an address once its burst is used up, others are answered
+    with a 429 error. 0 disables the limit. Takes effect when the plugin is
+    reloaded.""")))
+
+conf.registerGlobalValue(Taiga.admission, 'address-burst',
+    registry.PositiveInteger(1000, _("""Number of requests accepted at once
+    from an address. A Taiga instance sends all the requests of a bulk
+    change, so it should be at least the size of the queue. Takes effect
+    when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.admission, 'channel-rate',
+    NonNegativeFloat(0.0, _("""Number of requests per second
+    accepted for a channel once its burst is used up, others are answered
+    with a 429 error. 0 disables the limit. Takes effect when the plugin is
+    reloaded.""")))
+
+conf.registerGlobalValue(Taiga.admission, 'channel-burst',
+    registry.PositiveInteger(1000, _("""Number of requests accepted at once
+    for a channel. Bulk changes in Taiga send one request per item, so it
+    should be at least the size of the queue. Takes effect when the plugin
+    is reloaded.""")))
+
+# Sharding
+conf.registerGroup(Taiga, 'shard')
+
+conf.registerGlobalValue(Taiga.shard, 'peers',
+    registry.SpaceSeparatedListOfStrings([], _("""Base urls of the webhooks
+    of all the instances of the plugin sharing the projects, including this
+    one, e.g. http://10.0.0.1:8093/taiga. Each project is announced by one
+    of them, the others forward its notifications to it. Empty disables the
+    sharing.""")))
+
+conf.registerGlobalValue(Taiga.shard, 'self',
+    registry.String('', _("""Base url of the webhooks of this instance, as
+    listed in the peers. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.shard, 'secret',
+    registry.String('', _("""Secret shared by the instances, which
+    authenticates the notifications they forward to each other. Sharing is
+    disabled while it is empty. Takes effect when the plugin is
+    reloaded."""), private=True))
+
+conf.registerGlobalValue(Taiga.shard, 'replicas',
+    registry.PositiveInteger(100, _("""Number of points of each instance on
+    the hash ring, more spread the projects more evenly. Takes effect when
+    the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.shard, 'check-interval',
+    registry.PositiveInteger(10, _("""Number of seconds between checks of
+    which instances answer. Projects of the instances that do not are
+    announced by the others until they answer again. Takes effect when the
+    plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.shard, 'timeout',
+    registry.PositiveFloat(5.0, _("""Number of seconds after which an
+    instance that does not answer a forwarded notification is considered
+    gone. Takes effect when the plugin is reloaded.""")))
+
+# Queue
+conf.registerGroup(Taiga, 'queue')
+
+conf.registerGlobalValue(Taiga.queue, 'size',
+    registry.PositiveInteger(1000, _("""Maximum number of verified
+    notifications waiting to be announced. Takes effect when the plugin is
+    reloaded.""")))
+
+conf.registerGlobalValue(Taiga.queue, 'workers',
+    registry.NonNegativeInteger(2, _("""Number of threads announcing queued
+    notifications. If 0, notifications are announced before the webhook
+    request is answered. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.queue, 'drop-policy',
+    DropPolicy('newest', _("""Which notification is dropped when the queue is
+    full: 'newest' rejects the incoming notification, 'oldest' discards the
+    longest waiting one. Takes effect when the plugin is reloaded.""")))
+
+# Deduplication
+conf.registerGroup(Taiga, 'dedup')
+
+conf.registerGlobalValue(Taiga.dedup, 'ttl',
+    registry.NonNegativeInteger(600, _("""Number of seconds during which a
+    repeated delivery of the same notification is ignored. 0 disables the
+    deduplication. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.dedup, 'size',
+    registry.PositiveInteger(10000, _("""Maximum number of remembered
+    deliveries. Takes effect when the plugin is reloaded.""")))
+
+# Spool
+conf.registerGroup(Taiga, 'spool')
+
+conf.registerGlobalValue(Taiga.spool, 'budget',
+    registry.NonNegativeInteger(10 * 1024 * 1024, _("""Maximum size in bytes
+    of the journal that keeps the notifications for channels the bot is not
+    in yet, e.g. while it connects. The oldest notifications are dropped
+    beyond it. 0 disables the journal. Takes effect when the plugin is
+    reloaded.""")))
+
+conf.registerGlobalValue(Taiga.spool, 'segment-size',
+    registry.PositiveInteger(1024 * 1024, _("""Size in bytes of the files the
+    journal is split in. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.spool, 'max-age',
+    registry.NonNegativeInteger(3600, _("""Number of seconds after which a
+    notification in the journal is dropped instead of being announced. 0
+    keeps them until they are announced.""")))
+
+conf.registerGlobalValue(Taiga.spool, 'fsync',
+    registry.Boolean(False, _("""Determines whether every notification is
+    synced to disk as it is written to the journal, so it survives a crash
+    of the machine. Otherwise only the files the journal has finished
+    writing are, and the latest notifications survive a restart of the bot
+    only. Takes effect when the plugin is reloaded.""")))
+
+# Enrichment
+conf.registerGroup(Taiga, 'enrich')
+
+conf.registerGlobalValue(Taiga.enrich, 'enabled',
+    registry.Boolean(False, _("""Determines whether project, status and
+    assigned user names are looked up on the Taiga API. Takes effect when the
+    plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.enrich, 'token',
+    registry.String('', _("""API token used for the lookups, needed for
+    private projects. Takes effect when the plugin is reloaded."""),
+    private=True))
+
+conf.registerGlobalValue(Taiga.enrich, 'deadline',
+    registry.PositiveFloat(0.5, _("""Maximum number of seconds an
+    announcement waits for lookups. Names that are not known by then are
+    left out.""")))
+
+conf.registerGlobalValue(Taiga.enrich, 'ttl',
+    registry.PositiveInteger(600, _("""Number of seconds during which a
+    looked up name is reused. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.enrich, 'negative-ttl',
+    registry.PositiveInteger(60, _("""Number of seconds before a failed lookup
+    is tried again. Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.enrich, 'size',
+    registry.PositiveInteger(5000, _("""Maximum number of remembered names.
+    Takes effect when the plugin is reloaded.""")))
+
+conf.registerGlobalValue(Taiga.enrich, 'connections',
+    registry.PositiveInteger(4, _("""Number of concurrent lookups, and of
+    kept-alive connections per Taiga instance. Takes effect when the plugin
+    is reloaded.""")))
+
 # Format
 conf.registerGroup(Taiga, 'format')
 
 conf.registerChannelValue(Taiga.format, 'milestone-created',
-    registry.String(_("""\x02[{project[name]}]\x02 Milestone \x02#{milestone[id]} {milestone[name]}\x02 created by {user[name]} {url}"""),
-                    _("""Format for milestone/create events.""")))
+    FORMAT_STRINGS['milestone-created'](_("""\x02[{project[name]}]\x02 Milestone \x02#{milestone[id]} {milestone[name]}\x02 created by {user[name]} {url}"""),
+                                        _("""Format for milestone/create events.""")))
 conf.registerChannelValue(Taiga.format, 'milestone-deleted',
-    registry.String(_("""\x02[{project[name]}]\x02 Milestone \x02#{milestone[id]} {milestone[name]}\x02 deleted by {user[name]} {url}"""),
-                    _("""Format for milestone/delete events.""")))
+    FORMAT_STRINGS['milestone-deleted'](_("""\x02[{project[name]}]\x02 Milestone \x02#{milestone[id]} {milestone[name]}\x02 deleted by {user[name]} {url}"""),
+                                        _("""Format for milestone/delete events.""")))
 conf.registerChannelValue(Taiga.format, 'milestone-changed',
-    registry.String(_("""\x02[{project[name]}]\x02 Milestone \x02#{milestone[id]} {milestone[name]}\x02 changed by {user[name]} {url}"""),
-                    _("""Format for milestone/change events.""")))
+    FORMAT_STRINGS['milestone-changed'](_("""\x02[{project[name]}]\x02 Milestone \x02#{milestone[id]} {milestone[name]}\x02 changed by {user[name]} {url}"""),
+                                        _("""Format for milestone/change events.""")))
 
 conf.registerChannelValue(Taiga.format, 'userstory-created',
-    registry.String(_("""\x02[{project[name]}]\x02 Userstory \x02#{userstory[ref]} {userstory[subject]}\x02 created by {user[name]} {url}"""),
-                    _("""Format for userstory/create events.""")))
+    FORMAT_STRINGS['userstory-created'](_("""\x02[{project[name]}]\x02 Userstory \x02#{userstory[ref]} {userstory[subject]}\x02 created by {user[name]} {url}"""),
+                                        _("""Format for userstory/create events.""")))
 conf.registerChannelValue(Taiga.format, 'userstory-deleted',
-    registry.String(_("""\x02[{project[name]}]\x02 Userstory \x02#{userstory[ref]} {userstory[subject]}\x02 deleted by {user[name]} {url}"""),
-                    _("""Format for userstory/delete events.""")))
+    FORMAT_STRINGS['userstory-deleted'](_("""\x02[{project[name]}]\x02 Userstory \x02#{userstory[ref]} {userstory[subject]}\x02 deleted by {user[name]} {url}"""),
+                                        _("""Format for userstory/delete events.""")))
 conf.registerChannelValue(Taiga.format, 'userstory-changed',
-    registry.String(_("""\x02[{project[name]}]\x02 Userstory \x02#{userstory[ref]} {userstory[subject]}\x02 changed by {user[name]} {url}"""),
-                    _("""Format for userstory/change events.""")))
+    FORMAT_STRINGS['userstory-changed'](_("""\x02[{project[name]}]\x02 Userstory \x02#{userstory[ref]} {userstory[subject]}\x02 changed by {user[name]} {url}"""),
+                                        _("""Format for userstory/change events.""")))
 
 conf.registerChannelValue(Taiga.format, 'task-created',
-    registry.String(_("""\x02[{project[name]}]\x02 Task \x02#{task[ref]} {task[subject]}\x02 created by {user[name]} {url}"""),
-                    _("""Format for task/create events.""")))
+    FORMAT_STRINGS['task-created'](_("""\x02[{project[name]}]\x02 Task \x02#{task[ref]} {task[subject]}\x02 created by {user[name]} {url}"""),
+                                   _("""Format for task/create events.""")))
 conf.registerChannelValue(Taiga.format, 'task-deleted',
-    registry.String(_("""\x02[{project[name]}]\x02 Task \x02#{task[ref]} {task[subject]}\x02 deleted by {user[name]} {url}"""),
-                    _("""Format for task/delete events.""")))
+    FORMAT_STRINGS['task-deleted'](_("""\x02[{project[name]}]\x02 Task \x02#{task[ref]} {task[subject]}\x02 deleted by {user[name]} {url}"""),
+                                   _("""Format for task/delete events.""")))
 conf.registerChannelValue(Taiga.format, 'task-changed',
-    registry.String(_("""\x02[{project[name]}]\x02 Task \x02#{task[ref]} {task[subject]}\x02 changed by {user[name]} {url}"""),
-                    _("""Format for task/change events.""")))
+    FORMAT_STRINGS['task-changed'](_("""\x02[{project[name]}]\x02 Task \x02#{task[ref]} {task[subject]}\x02 changed by {user[name]} {url}"""),
+                                   _("""Format for task/change events.""")))
 
 conf.registerChannelValue(Taiga.format, 'issue-created',
-    registry.String(_("""\x02[{project[name]}]\x02 Issue \x02#{issue[ref]} {issue[subject]}\x02 created by {user[name]} {url}"""),
-                    _("""Format for issue/create events.""")))
+    FORMAT_STRINGS['issue-created'](_("""\x02[{project[name]}]\x02 Issue \x02#{issue[ref]} {issue[subject]}\x02 created by {user[name]} {url}"""),
+                                    _("""Format for issue/create events.""")))
 conf.registerChannelValue(Taiga.format, 'issue-deleted',
-    registry.String(_("""\x02[{project[name]}]\x02 Issue \x02#{issue[ref]} {issue[subject]}\x02 deleted by {user[name]} {url}"""),
-                    _("""Format for issue/delete events.""")))
+    FORMAT_STRINGS['issue-deleted'](_("""\x02[{project[name]}]\x02 Issue \x02#{issue[ref]} {issue[subject]}\x02 deleted by {user[name]} {url}"""),
+                                    _("""Format for issue/delete events.""")))
 conf.registerChannelValue(Taiga.format, 'issue-changed',
-    registry.String(_("""\x02[{project[name]}]\x02 Issue \x02#{issue[ref]} {issue[subject]}\x02 changed by {user[name]} {url}"""),
-                    _("""Format for issue/change events.""")))
+    FORMAT_STRINGS['issue-changed'](_("""\x02[{project[name]}]\x02 Issue \x02#{issue[ref]} {issue[subject]}\x02 changed by {user[name]} {url}"""),
+                                    _("""Format for issue/change events.""")))
 
 conf.registerChannelValue(Taiga.format, 'wikipage-created',
-    registry.String(_("""\x02[{project[name]}]\x02 Wikipage \x02#{wikipage[slug]} {wikipage[name]}\x02 created by {user[name]} {url}"""),
-                    _("""Format for wikipage/create events.""")))
+    FORMAT_STRINGS['wikipage-created'](_("""\x02[{project[name]}]\x02 Wikipage \x02#{wikipage[slug]} {wikipage[name]}\x02 created by {user[name]} {url}"""),
+                                       _("""Format for wikipage/create events.""")))
 conf.registerChannelValue(Taiga.format, 'wikipage-deleted',
-    registry.String(_("""\x02[{project[name]}]\x02 Wikipage \x02#{wikipage[slug]} {wikipage[name]}\x02 deleted by {user[name]} {url}"""),
-                    _("""Format for wikipage/delete events.""")))
+    FORMAT_STRINGS['wikipage-deleted'](_("""\x02[{project[name]}]\x02 Wikipage \x02#{wikipage[slug]} {wikipage[name]}\x02 deleted by {user[name]} {url}"""),
+                                       _("""Format for wikipage/delete events.""")))
 conf.registerChannelValue(Taiga.format, 'wikipage-changed',
-    registry.String(_("""\x02[{project[name]}]\x02 Wikipage \x02#{wikipage[slug]} {wikipage[name]}\x02 changed by {user[name]} {url}"""),
-                    _("""Format for wikipage/change events.""")))
+    FORMAT_STRINGS['wikipage-changed'](_("""\x02[{project[name]}]\x02 Wikipage \x02#{wikipage[slug]} {wikipage[name]}\x02 changed by {user[name]} {url}"""),
+                                       _("""Format for wikipage/change events.""")))
+
+conf.registerChannelValue(Taiga.format, 'digest-changed',
+    DigestFormatString(_("""\x02[{project[name]}]\x02 {kind} \x02#{item[ref]} {item[subject]}\x02 changed {count} times by {users} {url}"""),
+                       _("""Format for several changes of the same item within the coalescing window.""")))
+conf.registerChannelValue(Taiga.format, 'digest-created',
+    DigestFormatString(_("""\x02[{project[name]}]\x02 {count} {kinds} created{parent} by {users} {url}"""),
+                       _("""Format for several items created in the same parent within the coalescing window.""")))
 
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79:
@@ -0,0 +1,145 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_decoder = json.JSONDecoder()
+
+
+def loads(body):
+    """Decodes a JSON request body, using orjson if it is installed. Raises
+    ValueError on invalid data."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return _decoder.decode(body.decode('utf-8'))
+
+
+class Event(object):
+    """A Taiga notification that keeps only the fields of the payload that
+    are used by the plugin"""
+    __slots__ = ('action', 'project_id', 'user', 'change', 'date', 'data')
+
+    type = None
+    url_path = None
+    # Fields used to build urls, merge notifications and filter them
+    fields = frozenset(['id', 'ref', 'subject', 'name', 'slug',
+                        'user_story', 'milestone', 'tags', 'assigned_to'])
+
+    def __init__(self, payload, fields, keep_change):
+        payload_data = payload['data']
+        self.action = payload['action']
+        self.project_id = str(payload_data['project'])
+        self.date = payload.get('date')
+        self.data = dict((field, payload_data[field])
+                         for field in self.fields.union(fields)
+                         if field in payload_data)
+        if self.action == 'change':
+            change = payload['change']
+            self.user = change['user']
+            self.change = change if keep_change else None
+        else:
+            self.user = payload_data['owner']
+            self.change = None
+
+    def url(self, project_url):
+        return project_url + '/' + self.url_path % self.data
+
+    def format_args(self, project_id, project_slug, project_url):
+        args = {
+            self.type: self.data,
+            'project': {
+                'id': project_id,
+                'name': project_slug,
+                'url': project_url,
+            },
+            'user': self.user,
+            'url': self.url(project_url),
+        }
+        if self.change is not None:
+            args['change'] = self.change
+        return args
+
+
+class MilestoneEvent(Event):
+    __slots__ = ()
+    type = 'milestone'
+    url_path = 'taskboard/%(slug)s'
+
+
+class UserstoryEvent(Event):
+    __slots__ = ()
+    type = 'userstory'
+    url_path = 'us/%(ref)s'
+
+
+class TaskEvent(Event):
+    __slots__ = ()
+    type = 'task'
+    url_path = 'task/%(ref)s'
+
+
+class IssueEvent(Event):
+    __slots__ = ()
+    type = 'issue'
+    url_path = 'issue/%(ref)s'
+
+
+class WikipageEvent(Event):
+    __slots__ = ()
+    type = 'wikipage'
+    url_path = 'wiki/%(slug)s'
+
+
+EVENT_TYPES = dict((cls.type, cls) for cls in
+                   (MilestoneEvent, UserstoryEvent, TaskEvent, IssueEvent,
+                    WikipageEvent))
+
+
+def referenced_fields(payload_type, templates):
+    """Returns the payload fields referenced by <templates> and whether any
+    of them references the change"""
+    fields = set()
+    keep_change = False
+    for template in templates:
+        for path in template.fields:
+            if path[0] == payload_type and len(path) > 1:
+                fields.add(path[1])
+            elif path[0] == 'change':
+                keep_change = True
+    return (fields, keep_change)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
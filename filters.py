@@ -0,0 +1,143 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+from .events import EVENT_TYPES
+
+ACTIONS = ('create', 'change', 'delete')
+KEYS = ('type', 'action', 'changed', 'tag', 'assignee')
+
+
+def _tag_names(data):
+    """Returns the lowercased names of the tags of an item, which Taiga
+    sends either as names or as [name, color] pairs"""
+    names = set()
+    for tag in data.get('tags') or ():
+        if isinstance(tag, (list, tuple)):
+            tag = tag[0] if tag else None
+        if isinstance(tag, str):
+            names.add(tag.lower())
+    return names
+
+
+def _assignee_names(data):
+    """Returns the lowercased id, username and full name of the user an item
+    is assigned to, 'none' if it is not assigned"""
+    assigned_to = data.get('assigned_to')
+    if assigned_to is None:
+        return set(['none'])
+    if isinstance(assigned_to, dict):
+        return set(str(assigned_to[key]).lower()
+                   for key in ('id', 'username', 'full_name',
+                               'full_name_display', 'name')
+                   if assigned_to.get(key) is not None)
+    return set([str(assigned_to).lower()])
+
+
+def _changed(values, negate):
+    def predicate(action, data, diff):
+        # Creations and deletions change no field
+        if action != 'change':
+            return True
+        return bool(values.intersection(diff)) != negate
+    return predicate
+
+
+def _tagged(values, negate):
+    def predicate(action, data, diff):
+        return bool(values & _tag_names(data)) != negate
+    return predicate
+
+
+def _assigned(values, negate):
+    def predicate(action, data, diff):
+        return bool(values & _assignee_names(data)) != negate
+    return predicate
+
+
+_PREDICATES = {
+    'changed': _changed,
+    'tag': _tagged,
+    'assignee': _assigned,
+}
+
+
+class EventFilter(object):
+    """A channel filter compiled from rules like
+    'type:issue,task -action:delete changed:status -tag:wontfix', that all
+    have to match. A rule matches if any of its values does, and a rule
+    prefixed with '-' if none does."""
+    __slots__ = ('rules', 'empty', 'allowed', 'predicates')
+
+    def __init__(self, rules):
+        self.rules = str(rules)
+        types = set(EVENT_TYPES)
+        actions = set(ACTIONS)
+        self.predicates = []
+        for rule in self.rules.split():
+            negate = rule.startswith('-')
+            (key, sep, values) = rule.lstrip('-').partition(':')
+            values = frozenset(value.lower() for value in values.split(',')
+                               if value)
+            if key not in KEYS or not sep or not values:
+                raise ValueError('Invalid rule %r' % rule)
+
+            if key in ('type', 'action'):
+                known = EVENT_TYPES if key == 'type' else ACTIONS
+                unknown = values.difference(known)
+                if unknown:
+                    raise ValueError('Unknown %s %r' % (key, min(unknown)))
+                selected = types if key == 'type' else actions
+                if negate:
+                    selected.difference_update(values)
+                else:
+                    selected.intersection_update(values)
+            else:
+                self.predicates.append(_PREDICATES[key](values, negate))
+
+        self.empty = not self.rules.strip()
+        # The types and actions are checked in a single lookup
+        self.allowed = frozenset((payload_type, action)
+                                 for payload_type in types
+                                 for action in actions)
+
+    def matches(self, payload_type, action, data, diff):
+        """Returns whether a notification passes the filter, <diff> being
+        the changed fields of a change"""
+        if self.empty:
+            return True
+        if (payload_type, action) not in self.allowed:
+            return False
+        for predicate in self.predicates:
+            if not predicate(action, data, diff):
+                return False
+        return True
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -28,16 +28,41 @@
 
 ###
 
-import json
 import hmac
+import json
+import math
+import time
+import queue
 import hashlib
+import threading
+import collections
+import concurrent.futures
 
 from supybot.commands import *
+import supybot.conf as conf
 import supybot.ircdb as ircdb
-import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
 import supybot.callbacks as callbacks
 import supybot.log as log
+import supybot.world as world
+import supybot.schedule as schedule
 import supybot.httpserver as httpserver
+import supybot.utils as utils
+from .admission import AdmissionControl, RateLimiter
+from .api import STATUS_RESOURCES, ConnectionPool, LookupCache, TaigaApi
+from .config import parse_format_fields
+from .coalesce import Coalescer
+from .events import EVENT_TYPES, loads, referenced_fields
+from .filters import EventFilter
+from .projects import export_projects, parse_projects, project_host, \
+    project_url, sort_key
+from .profiling import Profiler
+from .receiver import AsyncReceiver
+from .shard import FORWARDED_HEADER, ShardRouter
+from .spool import Spool
+from .store import SqliteStore
+from .stats import Stats
+from .scheduler import OutboundScheduler, priority
 try:
     from supybot.i18n import PluginInternationalization
     from supybot.i18n import internationalizeDocstring
@@ -52,6 +77,266 @@ except ImportError:
         return x
 
 
+# Number of projects per page of 'taiga project list'
+LIST_PAGE_SIZE = 10
+
+# Maximum size of a document fetched by 'taiga project import'
+IMPORT_MAX_SIZE = 1024 * 1024
+
+# Default bounds of 'taiga profile start'
+PROFILE_EVENTS = 1000
+PROFILE_SECONDS = 60
+
+
+class ProjectIndex(object):
+    """Maps project ids to the channels subscribed to them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = ircutils.IrcDict()
+        self._projects = {}
+
+    def update(self, channel, projects):
+        """Replaces the subscriptions of <channel> with <projects>"""
+        projects = dict((str(project_id), project)
+                        for (project_id, project) in projects.items())
+        with self._lock:
+            for project_id in self._channels.pop(channel, {}):
+                subscribers = self._projects[project_id]
+                del subscribers[channel]
+                if not subscribers:
+                    del self._projects[project_id]
+            if projects:
+                self._channels[channel] = projects
+            for project_id, project in projects.items():
+                self._projects.setdefault(project_id,
+                                         ircutils.IrcDict())[channel] = project
+
+    def lookup(self, project_id):
+        """Returns a list of (channel, project) tuples subscribed to
+        <project_id>"""
+        with self._lock:
+            return list(self._projects.get(str(project_id), {}).items())
+
+    def subscribed(self, channel):
+        """Returns whether <channel> is subscribed to any project"""
+        with self._lock:
+            return channel in self._channels
+
+    def clear(self):
+        with self._lock:
+            self._channels.clear()
+            self._projects.clear()
+
+
+class Template(object):
+    """A format string and the field paths it references"""
+    __slots__ = ('format_string', 'fields')
+
+    def __init__(self, format_string):
+        self.format_string = str(format_string)
+        self.fields = parse_format_fields(format_string)
+
+    def render(self, args):
+        return self.format_string.format(**args)
+
+
+class ValueCache(object):
+    """Caches channel values per (channel, name) until their registry value
+    changes, optionally converted by <factory>"""
+
+    def __init__(self, plugin, factory=None):
+        self.plugin = plugin
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._values = {}
+        self._nodes = {}
+        # Keep a single bound method around, removeCallback() compares by
+        # identity
+        self._invalidate_callback = self.invalidate
+
+    def get(self, channel, name):
+        key = (channel, name)
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if key not in self._nodes:
+                node = self.plugin.registryValue(name, channel, value=False)
+                node.addCallback(self._invalidate_callback, key)
+                self._nodes[key] = node
+            value = self._nodes[key]()
+            if self.factory is not None:
+                value = self.factory(value)
+            self._values[key] = value
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            for node in self._nodes.values():
+                node.removeCallback(self._invalidate_callback)
+            self._nodes.clear()
+            self._values.clear()
+
+
+class MacCache(object):
+    """Keeps an HMAC keyed with the secret key of each channel, so that
+    verifying a signature only copies its state"""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self._macs = ircutils.IrcDict()
+
+    def get(self, channel):
+        """Returns a new HMAC of the secret key and digest of <channel>"""
+        # The values are cached until they change
+        secret_key = self.plugin._values.get(channel, 'secret-key')
+        digest = self.plugin._values.get(channel, 'signature-digest')
+        entry = self._macs.get(channel)
+        if entry is None or entry[0] != secret_key or entry[1] != digest:
+            entry = (secret_key, digest,
+                     hmac.new(secret_key.encode('utf-8'), digestmod=digest))
+            self._macs[channel] = entry
+        return entry[2].copy()
+
+    def clear(self):
+        self._macs.clear()
+
+
+class DedupCache(object):
+    """Remembers recently seen deliveries for <ttl> seconds, evicting the
+    least recently seen ones beyond <size> entries"""
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key):
+        """Returns whether <key> was seen within the TTL and records it"""
+        if not self.ttl:
+            return False
+        now = time.time()
+        with self._lock:
+            # Expire from the oldest end
+            while self._entries:
+                (oldest, stamp) = next(iter(self._entries.items()))
+                if stamp > now - self.ttl:
+                    break
+                del self._entries[oldest]
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._entries[key] = now
+                self.hits += 1
+                return True
+
+            self._entries[key] = now
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self.misses += 1
+            return False
+
+    def forget(self, key):
+        """Forgets <key>, e.g. because its delivery was rejected"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    @staticmethod
+    def body_key(form):
+        return ('body', hashlib.sha1(form).digest())
+
+    @staticmethod
+    def event_key(payload):
+        """Returns the key of an event, or None if the payload lacks the
+        fields to identify it"""
+        if not isinstance(payload, dict):
+            return None
+        data = payload.get('data')
+        if 'date' not in payload or not isinstance(data, dict) or \
+                'id' not in data:
+            return None
+        return ('event', payload.get('type'), payload.get('action'),
+                data['id'], payload['date'])
+
+
+class PayloadQueue(object):
+    """Bounded queues of verified notifications, one per worker thread.
+    Notifications with the same key are handled by the same worker, in the
+    order they were queued."""
+
+    def __init__(self, function, size, workers, drop_policy):
+        self.function = function
+        self.workers = workers
+        self.drop_policy = drop_policy
+        self.log = log.getPluginLogger('Taiga')
+        count = max(workers, 1)
+        self._queues = [queue.Queue(max(1, math.ceil(size / count)))
+                        for i in range(count)]
+        self._threads = []
+        self.dropped = 0
+
+    def start(self):
+        for (i, worker_queue) in enumerate(self._queues[:self.workers]):
+            thread = world.SupyThread(target=self._run, args=(worker_queue,),
+                                      name='Taiga worker #%i' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        for worker_queue in self._queues[:len(self._threads)]:
+            worker_queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def put(self, *args, key=None):
+        """Queues <args> for the worker of <key>, or runs the function right
+        away if there are no workers. Returns False if the queue is full and
+        the notification was dropped."""
+        if not self.workers:
+            self.function(*args)
+            return True
+
+        worker_queue = self._queues[hash(key) % len(self._queues)]
+        while True:
+            try:
+                worker_queue.put_nowait(args)
+                return True
+            except queue.Full:
+                self.dropped += 1
+                if self.drop_policy != 'oldest':
+                    return False
+            try:
+                worker_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+    def qsize(self):
+        return sum(worker_queue.qsize() for worker_queue in self._queues)
+
+    def _run(self, worker_queue):
+        while True:
+            args = worker_queue.get()
+            if args is None:
+                return
+            try:
+                self.function(*args)
+            except Exception:
+                self.log.exception('Taiga: Error while handling a '
+                                   'queued notification.')
+
+
 class TaigaHandler(object):
     """Handle taiga messages"""
 
@@ -59,21 +344,41 @@ class TaigaHandler(object):
         self.irc = irc
         self.plugin = plugin
         self.log = log.getPluginLogger('Taiga')
-
-    def _build_url(self, project_url, project_slug, payload_type, payload):
-        appendix = None
-        if payload_type == 'milestone':
-            appendix = 'taskboard/' + payload['data']['slug']
-        elif payload_type == 'userstory':
-            appendix = 'us/' + str(payload['data']['ref'])
-        elif payload_type == 'task':
-            appendix = 'task/' + str(payload['data']['ref'])
-        elif payload_type == 'issue':
-            appendix = 'issue/' + str(payload['data']['ref'])
-        elif payload_type == 'wikipage':
-            appendix = 'wiki/' + payload['data']['slug']
-
-        return project_url + '/' + appendix
+        self.coalescer = Coalescer(self._send_message)
+        self.scheduler = OutboundScheduler(self._queue_msg,
+                                           self._throttle_settings,
+                                           self._max_targets)
+        self.scheduler.start()
+
+    def stop(self):
+        """Announces the pending notifications"""
+        self.coalescer.flush_all()
+        self.scheduler.stop()
+
+    def _queue_msg(self, msg):
+        start = time.perf_counter()
+        self.irc.queueMsg(msg)
+        self.plugin._stats.observe('queue', time.perf_counter() - start)
+
+    def _max_targets(self):
+        """Returns to how many channels a PRIVMSG can be sent at once,
+        according to the ISUPPORT TARGMAX or MAXTARGETS tokens"""
+        supported = self.irc.state.supported
+        targmax = supported.get('targmax')
+        if targmax:
+            for token in targmax.split(','):
+                (command, _sep, limit) = token.partition(':')
+                if command.upper() == 'PRIVMSG':
+                    # No limit means any number, the line length still
+                    # applies
+                    return int(limit) if limit else 64
+        return supported.get('maxtargets') or 1
+
+    def _throttle_settings(self, channel):
+        values = self.plugin._values
+        return (values.get(channel, 'throttle.rate'),
+                values.get(channel, 'throttle.burst'),
+                values.get(channel, 'throttle.backlog'))
 
     def handle_payload(self, payload):
         for x in ['type', 'action', 'data']:
@@ -82,55 +387,230 @@ class TaigaHandler(object):
 
         payload_type = payload['type']
         payload_action = payload['action']
-        payload_data = payload['data']
 
         # Do not handle test payloads
         if payload_type == 'test':
             return
 
-        if payload_type not in ['milestone', 'userstory', 'task', 'issue',
-                                'wikipage']:
+        if payload_type not in EVENT_TYPES:
             self.log.debug("Unhandled type: '%s'" % payload_type)
             return
 
-        # Lookup format string
-        format_string_identifier = "format.%s-%sd" % (payload_type, payload_action)
-        project_id = payload_data['project']
-
-        # Prepare argument data
-        data = {
-            payload_type: payload_data,
-            "project": {
-                "id": project_id,
-                "name": ""
-            },
-            "user": payload_data['owner'],
-        }
-
-        if payload_action == 'change':
-            data['change'] = payload['change']
-            data['user'] = payload['change']['user']
-
-        # Check if any of the joined channels have subscribed to this project
-        for channel in self.irc.state.channels.keys():
-            projects = self.plugin._load_projects(channel)
-            project_id = str(project_id)
-            if project_id in projects.keys():
+        stats = self.plugin._stats
+        start = time.perf_counter()
+
+        # Only look at the joined channels that have subscribed to this
+        # project
+        subscribers = [(channel, project) for (channel, project)
+                       in self.plugin._index.lookup(payload['data']['project'])
+                       if channel in self.irc.state.channels]
+        if not subscribers:
+            stats.incr('unsubscribed')
+            return
+
+        # Apply the channel filters to the payload, before anything is built
+        # for it
+        data = payload['data']
+        diff = None
+        if payload_action == 'change' and isinstance(payload.get('change'),
+                                                     dict):
+            diff = payload['change'].get('diff')
+        diff = diff or {}
+        filters = self.plugin._filters
+        subscribers = [(channel, project) for (channel, project) in subscribers
+                       if filters.get(channel, 'filter').matches(
+                           payload_type, payload_action, data, diff)]
+        if not subscribers:
+            stats.incr('filtered')
+            return
+
+        # Lookup format strings and only keep the fields they use
+        format_string_identifier = "format.%s-%sd" % (payload_type,
+                                                      payload_action)
+        templates = [self.plugin._templates.get(channel,
+                                                format_string_identifier)
+                     for (channel, project) in subscribers]
+        (fields, keep_change) = referenced_fields(payload_type, templates)
+        event = EVENT_TYPES[payload_type](payload, fields, keep_change)
+        stats.observe('route', time.perf_counter() - start)
+
+        names = {}
+        if self.plugin._api is not None:
+            start = time.perf_counter()
+            names = self._lookup_names(event, subscribers, templates)
+            stats.observe('enrich', time.perf_counter() - start)
+
+        rendered = {}
+        targets = collections.OrderedDict()
+        for ((channel, project), template) in zip(subscribers, templates):
+            # Send message to channel, merging bursts if configured
+            window = self.plugin._values.get(channel, 'coalesce-window')
+            if window:
                 # Update with project slug from mapping
-                project_slug = projects[project_id]['slug']
-                project_url = projects[project_id]['url']
-                data['project']['name'] = project_slug
-                data['url'] = self._build_url(project_url, project_slug,
-                                              payload_type, payload)
+                args = event.format_args(event.project_id, project['slug'],
+                                         project['url'])
+                _apply_names(args, event.type, names.get(project['url']))
+                self.coalescer.add(channel, window, payload_type,
+                                   payload_action, format_string_identifier,
+                                   args)
+                continue
+
+            # Channels with the same template and mapping get the same line
+            key = (template.format_string, project['slug'], project['url'])
+            if key not in rendered:
+                args = event.format_args(event.project_id, project['slug'],
+                                         project['url'])
+                _apply_names(args, event.type, names.get(project['url']))
+                rendered[key] = self._render(template, args)
+            msg = rendered[key]
+            if msg is not None:
+                targets.setdefault(msg, []).append(channel)
+
+        payload_priority = priority(format_string_identifier)
+        for (msg, channels) in targets.items():
+            self.scheduler.send_all(channels, payload_priority, msg)
+
+    def _lookup_names(self, event, subscribers, templates):
+        """Returns the names of the project, status and assigned user of
+        <event> on the Taiga instance of each project url, as far as they
+        are known before the deadline"""
+        api = self.plugin._api
+        referenced = set()
+        for template in templates:
+            referenced.update(template.fields)
+        status = event.data.get('status')
+        assigned_to = event.data.get('assigned_to')
+
+        futures = {}
+        for url in set(project['url'] for (channel, project)
+                               in subscribers):
+            if ('project', 'name') in referenced:
+                futures[(url, 'project')] = api.project_name(
+                    url, event.project_id)
+            # Recent Taiga versions send names already
+            if (event.type, 'status') in referenced and \
+                    event.type in STATUS_RESOURCES and \
+                    isinstance(status, int):
+                futures[(url, 'status')] = api.status_name(
+                    url, event.type, status)
+            if (event.type, 'assigned_to') in referenced and \
+                    isinstance(assigned_to, int):
+                futures[(url, 'assigned_to')] = api.user_name(
+                    url, assigned_to)
+        if not futures:
+            return {}
 
-                # Send message to channel
-                self._send_message(channel, format_string_identifier, data)
+        concurrent.futures.wait(futures.values(),
+                                self.plugin.registryValue('enrich.deadline'))
+        names = collections.defaultdict(dict)
+        for ((url, name), future) in futures.items():
+            if future.done() and future.result() is not None:
+                names[url][name] = future.result()
+        return names
+
+    def _render(self, template, args):
+        """Returns the line of <template>, or None if the notification lacks
+        a field it references"""
+        start = time.perf_counter()
+        try:
+            msg = template.render(args)
+        except (KeyError, IndexError, AttributeError, ValueError,
+                TypeError) as e:
+            self.log.warning('Taiga: Cannot render %r: %r',
+                             template.format_string, e)
+            self.plugin._stats.incr('unrendered')
+            return None
+        self.plugin._stats.observe('format', time.perf_counter() - start)
+        return msg
 
     def _send_message(self, channel, format_string_identifier, args):
-        format_string = str(self.plugin.registryValue(format_string_identifier, channel))
-        msg = format_string.format(**args)
-        priv_msg = ircmsgs.privmsg(channel, msg)
-        self.irc.queueMsg(priv_msg)
+        template = self.plugin._templates.get(channel, format_string_identifier)
+        msg = self._render(template, args)
+        if msg is not None:
+            self.scheduler.send(channel, priority(format_string_identifier),
+                                msg)
+
+
+def _apply_names(args, payload_type, names):
+    """Replaces the slug and ids in the format <args> by the looked up
+    <names>"""
+    if not names:
+        return
+    if 'project' in names:
+        args['project']['name'] = names['project']
+    fields = dict((field, names[field]) for field in ('status', 'assigned_to')
+                  if field in names)
+    if fields:
+        args[payload_type] = dict(args[payload_type], **fields)
+
+
+class NetworkDispatcher(object):
+    """Resolves network names to the TaigaHandler of their Irc object"""
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self._lock = threading.Lock()
+        self._handlers = {}
+
+    def get(self, network):
+        """Returns the handler of <network>, or None if the bot is not
+        connected to it"""
+        key = network.lower()
+        handler = self._handlers.get(key)
+        if handler is not None and not handler.irc.zombie:
+            return handler
+
+        irc = world.getIrc(network)
+        if irc is None or irc.zombie:
+            return None
+        with self._lock:
+            handler = self._handlers.get(key)
+            if handler is None or handler.irc is not irc:
+                if handler is not None:
+                    handler.stop()
+                handler = self._handlers[key] = TaigaHandler(self.plugin, irc)
+        return handler
+
+    def resolve(self, networks):
+        """Returns the handlers of a comma-separated list of networks, or of
+        all connected networks for '*'. Unknown networks are left out."""
+        if networks == '*':
+            names = [irc.network for irc in world.ircs if not irc.zombie]
+        else:
+            names = networks.split(',')
+        handlers = []
+        for name in names:
+            handler = self.get(name)
+            if handler is not None and handler not in handlers:
+                handlers.append(handler)
+        return handlers
+
+    def targets(self, networks, channel):
+        """Returns the handlers of <networks> where the bot is in <channel>,
+        and the names of the networks where it is not"""
+        ready = []
+        missing = []
+        if networks == '*':
+            ready = [handler for handler in self.resolve('*')
+                     if channel in handler.irc.state.channels]
+            if not ready:
+                missing.append('*')
+            return (ready, missing)
+
+        for name in networks.split(','):
+            handler = self.get(name)
+            if handler is not None and channel in handler.irc.state.channels:
+                if handler not in ready:
+                    ready.append(handler)
+            elif name not in missing:
+                missing.append(name)
+        return (ready, missing)
+
+    def stop(self):
+        with self._lock:
+            for handler in self._handlers.values():
+                handler.stop()
+            self._handlers.clear()
 
 
 class TaigaWebHookService(httpserver.SupyHTTPServerCallback):
@@ -139,49 +619,139 @@ class TaigaWebHookService(httpserver.SupyHTTPServerCallback):
     name = "TaigaWebHookService"
     defaultResponse = """This plugin handles only POST request, please don't use other requests."""
 
-    def __init__(self, plugin, irc):
+    def __init__(self, plugin):
         self.log = log.getPluginLogger('Taiga')
-        self.taiga = TaigaHandler(plugin, irc)
         self.plugin = plugin
-        self.irc = irc
 
-    def _verify_signature(self, key, data, signature):
-        mac = hmac.new(key.encode("utf-8"), msg=data, digestmod=hashlib.sha1)
-        return mac.hexdigest() == signature
-
-    def _send_error(self, handler, message):
-        handler.send_response(403)
+    def _verify_signature(self, mac, signature):
+        """Compares the signature to the HMAC of the body in constant
+        time"""
+        return hmac.compare_digest(mac.hexdigest().encode('ascii'),
+                                   signature.encode('utf-8'))
+
+    def signature_mac(self, path):
+        """Returns a new HMAC to verify the body of a request to <path> as it
+        arrives, or None if it is not verified"""
+        target = self._parse_path(path)
+        if target is None or not self._known(*target) or \
+                not self.plugin._values.get(target[1], 'verify-signature'):
+            return None
+        return self.plugin._macs.get(target[1])
+
+    def _send_error(self, handler, message, code=403, retry_after=None):
+        handler.send_response(code)
         handler.send_header('Content-type', 'text/plain')
+        if retry_after is not None:
+            handler.send_header('Retry-After', max(1, math.ceil(retry_after)))
         handler.end_headers()
         handler.wfile.write(message.encode('utf-8'))
 
-    def _send_ok(self, handler):
-        handler.send_response(200)
+    def _send_not_found(self, handler, message):
+        self._send_error(handler, message, 404)
+
+    def _send_ok(self, handler, code=200):
+        handler.send_response(code)
         handler.send_header('Content-type', 'text/plain')
         handler.end_headers()
         handler.wfile.write(bytes('OK', 'utf-8'))
 
-    def doPost(self, handler, path, form):
-        headers = dict(self.headers)
+    def doGet(self, handler, path):
+        if path != '/stats':
+            return super(TaigaWebHookService, self).doGet(handler, path)
+        response = json.dumps(self.plugin._get_stats()).encode('utf-8')
+        handler.send_response(200)
+        handler.send_header('Content-type', 'application/json')
+        handler.send_header('Content-Length', len(response))
+        handler.end_headers()
+        handler.wfile.write(response)
+
+    def _parse_path(self, path):
+        """Returns the network and the channel of a webhook path, or None"""
+        information = path.split('/')[1:]
+        if len(information) < 2:
+            return None
+        return (information[0], '#' + information[1])
+
+    def _known(self, network, channel):
+        """Returns whether notifications for <channel> on <network> can be
+        announced, before anything is cached for them"""
+        if not self.plugin._index.subscribed(channel):
+            return False
+        if network == '*':
+            return True
+        networks = conf.supybot.networks()
+        return all(name in networks or world.getIrc(name) is not None
+                   for name in network.split(','))
+
+    def admit(self, handler, path):
+        """Applies the admission control to a request, before its body is
+        verified. Answers and returns False if it is not admitted, else the
+        request has to be released once handled."""
+        stats = self.plugin._stats
+        stats.incr('requests')
+        try:
+            length = int(handler.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = 0
+        address = getattr(handler, 'client_address', None)
+        # Other instances forward the notifications of many senders
+        shard = self.plugin._shard
+        if shard is not None and \
+                shard.verify(handler.headers.get(FORWARDED_HEADER), path):
+            address = None
+        target = self._parse_path(path)
+        rejection = self.plugin._admission.admit(
+            length, address[0] if address else None,
+            target and (target[0].lower(), ircutils.toLower(target[1])))
+        if rejection is None:
+            return True
+
+        (reason, retry_after) = rejection
+        stats.incr(reason)
+        if reason == 'too-large':
+            self._send_error(handler, _('Error: The notification is too '
+                                        'large.'), 413)
+        elif reason == 'overloaded':
+            self._send_error(handler, _('Error: Too many pending requests.'),
+                             503, retry_after)
+        else:
+            self._send_error(handler, _('Error: Too many requests.'), 429,
+                             retry_after)
+        return False
 
-        network = None
-        channel = None
+    def release(self):
+        """Counts an admitted request as handled"""
+        self.plugin._admission.release()
 
+    def doPost(self, handler, path, form):
+        if not self.admit(handler, path):
+            return
         try:
-            information = path.split('/')[1:]
-            network = information[0]
-            channel = '#' + information[1]
-        except IndexError:
+            self.receive(handler, path, form)
+        finally:
+            self.release()
+
+    def receive(self, handler, path, form, mac=None):
+        """Handles an admitted request, sending a single response. <mac> is
+        the HMAC of <form> if it was computed as the body arrived."""
+        headers = dict(handler.headers)
+        stats = self.plugin._stats
+
+        target = self._parse_path(path)
+        if target is None:
             self._send_error(handler, _("""Error: You need to provide the
                                         network name and the channel in
                                         url."""))
             return
-
-        if self.irc.network != network or channel not in self.irc.state.channels:
+        (network, channel) = target
+        # Unknown paths must not fill the caches, nor the spool
+        if not self._known(network, channel):
+            self._send_not_found(handler, _('Error: No project is announced '
+                                            'in this channel on this '
+                                            'network.'))
             return
 
-        secret_key = self.plugin.registryValue('secret-key', channel)
-        verify_signature = self.plugin.registryValue('verify-signature', channel)
+        verify_signature = self.plugin._values.get(channel, 'verify-signature')
 
         # Check for Taiga webhook signature
         if verify_signature is True:
@@ -191,24 +761,155 @@ class TaigaWebHookService(httpserver.SupyHTTPServerCallback):
 
             # Verify signature
             signature = headers['X-TAIGA-WEBHOOK-SIGNATURE']
-            if self._verify_signature(secret_key, form, signature) is False:
+            start = time.perf_counter()
+            if mac is None:
+                mac = self.plugin._macs.get(channel)
+                mac.update(form)
+            verified = self._verify_signature(mac, signature)
+            stats.observe('verify', time.perf_counter() - start)
+            if verified is False:
                 self._send_error(handler, _('Error: Invalid signature.'))
                 return
 
-        # Handle payload
-        try:
-            payload = json.JSONDecoder().decode(form.decode('utf-8'))
-        except Exception as e:
-            self._send_error(handler, _('Error: Invalid JSON data sent.'))
+        # The project of the notification decides which instance and which
+        # worker handle it
+        (payload, project_key) = self._decode(form)
+        if payload is None:
+            self.log.warning('Taiga: Invalid JSON data sent.')
+            stats.incr('invalid')
+            self._send_error(handler, _('Error: Invalid JSON data sent.'),
+                             400)
+            return
+        if payload.get('type') == 'test':
+            # Sent by the test button of Taiga, nothing to announce
+            self._send_ok(handler)
+            return
+        if project_key is None:
+            stats.incr('invalid')
+            self._send_error(handler, _('Error: The notification has no '
+                                        'project.'), 400)
+            return
 
-        try:
-            self.taiga.handle_payload(payload)
-        except Exception as e:
-            self._send_error(handler, _('Error: Invalid data sent.'))
+        # Hand the notifications of the projects owned by other instances
+        # over to them
+        shard = self.plugin._shard
+        if shard is not None and \
+                not shard.verify(handler.headers.get(FORWARDED_HEADER), path):
+            response = self._forward(project_key, path, form, headers)
+            if response is not None:
+                stats.incr('forwarded')
+                self._send_error(handler, response[1].decode('utf-8',
+                                                             'replace'),
+                                 response[0])
+                return
+
+        # Taiga retries deliveries that time out
+        key = DedupCache.body_key(form)
+        if self.plugin._dedup.seen(key):
+            self.log.debug('Taiga: Ignoring duplicate delivery.')
+            stats.incr('duplicates')
+            self._send_ok(handler)
+            return
+
+        # Keep the notification for the networks where the bot is not in the
+        # channel yet
+        (taigas, missing) = self.plugin._dispatcher.targets(network, channel)
+        spool = self.plugin._spool
+        if missing and spool is not None:
+            for name in missing:
+                spool.append(name, channel, form)
+            stats.incr('spooled', len(missing))
+        elif not taigas:
+            self.plugin._dedup.forget(key)
+            self._send_not_found(handler, _('Error: The bot is not in this '
+                                            'channel on this network.'))
+            return
+
+        if not taigas:
+            self._send_ok(handler, 202)
+            return
+
+        # Hand the payload over to the worker of its project, which keeps
+        # the notifications of an item in order
+        if not self.plugin._queue.put(taigas, form, True, payload,
+                                      key=project_key):
+            self.plugin._dedup.forget(key)
+            stats.incr('dropped')
+            self._send_error(handler, _('Error: Too many pending '
+                                        'notifications.'), 503, 1)
+            return
+
+        stats.incr('accepted')
 
         # Return OK
         self._send_ok(handler)
 
+    def _forward(self, project_id, path, form, headers):
+        """Forwards a verified notification to the instance owning its
+        project. Returns its response, or None if it is handled here."""
+        forward_headers = {'Content-Type': 'application/json'}
+        if 'X-TAIGA-WEBHOOK-SIGNATURE' in headers:
+            forward_headers['X-TAIGA-WEBHOOK-SIGNATURE'] = \
+                headers['X-TAIGA-WEBHOOK-SIGNATURE']
+        return self.plugin._shard.forward(project_id, path, form,
+                                          forward_headers)
+
+    def _decode(self, form):
+        """Returns the decoded payload of <form> and the key of its project.
+        The payload is None if <form> is not a JSON object, the key if it
+        has no project."""
+        start = time.perf_counter()
+        try:
+            payload = loads(form)
+        except ValueError:
+            return (None, None)
+        if not isinstance(payload, dict):
+            return (None, None)
+        self.plugin._stats.observe('decode', time.perf_counter() - start)
+        data = payload.get('data')
+        if not isinstance(data, dict) or 'project' not in data:
+            return (payload, None)
+        return (payload, str(data['project']))
+
+    def deliver_spooled(self, network, channel, form):
+        """Queues a spooled notification if the bot is in <channel> on
+        <network> by now"""
+        (taigas, missing) = self.plugin._dispatcher.targets(network, channel)
+        if not taigas:
+            return False
+        (payload, project_key) = self._decode(form)
+        return self.plugin._queue.put(taigas, form, False, payload,
+                                      key=project_key)
+
+    def process(self, taigas, form, check_duplicates=True, payload=None):
+        """Decodes, unless <payload> is given, and announces a verified
+        notification on the networks of <taigas>"""
+        stats = self.plugin._stats
+        if payload is None:
+            start = time.perf_counter()
+            try:
+                payload = loads(form)
+            except ValueError:
+                self.log.warning('Taiga: Invalid JSON data sent.')
+                stats.incr('invalid')
+                return
+            stats.observe('decode', time.perf_counter() - start)
+
+        # Catch duplicates whose body differs, e.g. in the key order. Spooled
+        # notifications may already have been announced on other networks.
+        key = DedupCache.event_key(payload)
+        if check_duplicates and key is not None and \
+                self.plugin._dedup.seen(key):
+            self.log.debug('Taiga: Ignoring duplicate event.')
+            stats.incr('duplicates')
+            return
+
+        for taiga in taigas:
+            try:
+                taiga.handle_payload(payload)
+            except Exception:
+                self.log.exception('Taiga: Invalid data sent.')
+
 
 class Taiga(callbacks.Plugin):
     """Plugin for communication and notifications of a Taiga project management tool instance"""
@@ -219,15 +920,279 @@ class Taiga(callbacks.Plugin):
         super(Taiga, self).__init__(irc)
         instance = self
 
-        callback = TaigaWebHookService(self, irc)
-        httpserver.hook('taiga', callback)
+        self._templates = ValueCache(self, Template)
+        self._values = ValueCache(self)
+        self._filters = ValueCache(self, EventFilter)
+        self._macs = MacCache(self)
+        self._index = ProjectIndex()
+        self._watched = ircutils.IrcDict()
+        # Keep a single bound method around, removeCallback() compares by
+        # identity
+        self._reindex_callback = self._reindex_channel
+        self._store = None
+        self._snapshot = ircutils.IrcDict()
+        if self.registryValue('store') == 'sqlite':
+            self._store = SqliteStore(
+                conf.supybot.directories.data.dirize('Taiga.db'))
+        self._build_index(irc)
+
+        self._stats = Stats()
+        self._dispatcher = NetworkDispatcher(self)
+        callback = TaigaWebHookService(self)
+        self._service = callback
+        self._admission = AdmissionControl(
+            self.registryValue('admission.max-body-size'),
+            self.registryValue('admission.max-in-flight'),
+            RateLimiter(self.registryValue('admission.address-rate'),
+                        self.registryValue('admission.address-burst')),
+            RateLimiter(self.registryValue('admission.channel-rate'),
+                        self.registryValue('admission.channel-burst')))
+        self._dedup = DedupCache(self.registryValue('dedup.ttl'),
+                                 self.registryValue('dedup.size'))
+        self._queue = PayloadQueue(callback.process,
+                                   self.registryValue('queue.size'),
+                                   self.registryValue('queue.workers'),
+                                   self.registryValue('queue.drop-policy'))
+        self._queue.start()
+
+        self._api = None
+        if self.registryValue('enrich.enabled'):
+            connections = self.registryValue('enrich.connections')
+            deadline = self.registryValue('enrich.deadline')
+            self._api = TaigaApi(
+                ConnectionPool(connections, max(deadline, 5)),
+                LookupCache(self.registryValue('enrich.ttl'),
+                            self.registryValue('enrich.negative-ttl'),
+                            self.registryValue('enrich.size')),
+                connections, self.registryValue('enrich.token') or None)
+
+        self._shard = None
+        self._shard_event = None
+        self._shard_callback = self._update_shards
+        conf.supybot.plugins.Taiga.shard.peers.addCallback(
+            self._shard_callback)
+        self._update_shards()
+
+        self._spool = None
+        self._replay_event = None
+        if self.registryValue('spool.budget'):
+            self._spool = Spool(conf.supybot.directories.data.dirize('Taiga'),
+                                self.registryValue('spool.segment-size'),
+                                self.registryValue('spool.budget'),
+                                self.registryValue('spool.fsync'))
+            self._schedule_replay()
+
+        self._profiler = None
+        self._profile_event = None
+        self._profile_lock = threading.Lock()
+
+        self._receiver = None
+        if self.registryValue('receiver.mode') == 'asyncio':
+            self._receiver = AsyncReceiver(
+                callback, self.registryValue('receiver.host'),
+                self.registryValue('receiver.port'),
+                self.registryValue('receiver.max-connections'),
+                self.registryValue('receiver.timeout'))
+            self._receiver.start()
+        else:
+            httpserver.hook('taiga', callback)
 
     def die(self):
-        httpserver.unhook('taiga')
+        if self._receiver is not None:
+            self._receiver.stop()
+        else:
+            httpserver.unhook('taiga')
+        if self._replay_event is not None:
+            schedule.removeEvent(self._replay_event)
+        conf.supybot.plugins.Taiga.shard.peers.removeCallback(
+            self._shard_callback)
+        self._stop_shards()
+        self._stop_profile()
+        self._queue.stop()
+        self._dispatcher.stop()
+        if self._api is not None:
+            self._api.stop()
+        if self._spool is not None:
+            self._spool.close()
+        if self._store is not None:
+            self._store.close()
+
+        for node in self._watched.values():
+            node.removeCallback(self._reindex_callback)
+        self._watched.clear()
+        self._index.clear()
+        self._templates.clear()
+        self._values.clear()
+        self._filters.clear()
+        self._macs.clear()
 
         super(Taiga, self).die()
 
+    def _update_shards(self):
+        """Starts sharing the projects with the peers, or updates them"""
+        peers = [peer.rstrip('/') for peer in self.registryValue('shard.peers')]
+        self_url = self.registryValue('shard.self').rstrip('/')
+        secret = self.registryValue('shard.secret')
+        if not peers or not self_url:
+            self._stop_shards()
+            return
+        if not secret:
+            self.log.error('Taiga: plugins.Taiga.shard.secret is not set, '
+                           'the projects are not shared.')
+            self._stop_shards()
+            return
+        if self._shard is not None:
+            self._shard.set_peers(peers)
+            return
+        self._shard = ShardRouter(
+            self_url, peers,
+            ConnectionPool(4, self.registryValue('shard.timeout')),
+            secret, self.registryValue('shard.replicas'))
+        self._shard_event = schedule.addPeriodicEvent(
+            self._shard.check, self.registryValue('shard.check-interval'),
+            name='Taiga shard check', now=False)
+
+    def _stop_shards(self):
+        if self._shard_event is not None:
+            schedule.removePeriodicEvent(self._shard_event)
+            self._shard_event = None
+        if self._shard is not None:
+            self._shard.pool.close()
+            self._shard = None
+
+    def _start_profile(self, max_events, seconds, memory):
+        """Profiles the requests and notifications until <max_events>
+        notifications were handled or for <seconds>"""
+        profiler = Profiler(max_events, memory,
+                            on_limit=self._stop_profile)
+        # Both receivers call receive(), the workers call process() through
+        # the queue. Only these attributes are replaced, so nothing else
+        # changes when no profile is running.
+        profiler.attach(self._service, 'receive')
+        profiler.attach(self._queue, 'function', count=True)
+        self._profiler = profiler
+        self._profile_event = schedule.addEvent(self._stop_profile,
+                                                time.time() + seconds)
+        profiler.start()
+
+    def _stop_profile(self):
+        """Stops the running profile, writes it to the data directory and
+        returns its summary, or None if no profile was running"""
+        with self._profile_lock:
+            if self._profile_event is not None:
+                try:
+                    schedule.removeEvent(self._profile_event)
+                except KeyError:
+                    # Running it
+                    pass
+                self._profile_event = None
+            profiler = self._profiler
+            if profiler is None or not profiler.stop():
+                return None
+        summary = self._dump_profile(profiler)
+        self.log.info('Taiga: %s', summary)
+        return summary
+
+    def _dump_profile(self, profiler):
+        """Writes the results of <profiler> to the data directory and
+        returns their summary"""
+        path = conf.supybot.directories.data.dirize(
+            time.strftime('Taiga-profile-%Y%m%d-%H%M%S.prof'))
+        paths = profiler.dump(path)
+        summary = [_('Profiled %i notifications%s, written to %s') % (
+            profiler.events,
+            _(' so far') if profiler.running else '',
+            ' and '.join(paths) or _('nothing'))]
+        if profiler.skipped:
+            summary[0] += _(' (%i calls were not profiled while another '
+                            'one was)') % profiler.skipped
+        functions = profiler.top_functions()
+        if functions:
+            summary.append(_('Top functions: %s') % ', '.join(
+                '%s %i calls %.1fms' % (name, calls, seconds * 1000)
+                for (name, calls, seconds) in functions))
+        allocations = profiler.top_allocations()
+        if allocations:
+            summary.append(_('Top allocations: %s') % ', '.join(
+                '%s %s in %i blocks' % (site, utils.str.format('%S', size),
+                                        blocks)
+                for (site, size, blocks) in allocations))
+        return '. '.join(summary)
+
+    def _build_index(self, irc):
+        """Indexes the subscriptions of every channel that has a projects
+        value in the registry, or in the store"""
+        group = conf.supybot.plugins.Taiga.projects
+        channels = set(irc.state.channels.keys())
+        for other in world.ircs:
+            channels.update(other.state.channels.keys())
+        for (name, node) in group.getValues(fullNames=False):
+            if ircutils.isChannel(name):
+                channels.add(name)
+
+        if self._store is None:
+            for channel in channels:
+                self._watch_channel(channel)
+            return
+
+        if not self._store.migrated():
+            registry_projects = {}
+            for channel in channels:
+                projects = self.registryValue('projects', channel)
+                if projects:
+                    registry_projects[channel] = projects
+            self._store.migrate(registry_projects)
+            self.log.info('Taiga: Imported the projects of %i channels into '
+                          '%s.', len(registry_projects), self._store.path)
+        self._snapshot.clear()
+        self._snapshot.update(self._store.load_all())
+        for (channel, projects) in self._snapshot.items():
+            self._index.update(channel, projects)
+
+    def _watch_channel(self, channel):
+        """Keeps the index of <channel> in sync with its registry value"""
+        if self._store is not None:
+            # The store is only changed through _save_projects
+            return
+        if channel not in self._watched:
+            node = self.registryValue('projects', channel, value=False)
+            node.addCallback(self._reindex_callback, channel)
+            self._watched[channel] = node
+        self._reindex_channel(channel)
+
+    def _reindex_channel(self, channel):
+        self._index.update(channel, self._load_projects(channel))
+
+    def doJoin(self, irc, msg):
+        if ircutils.strEqual(msg.nick, irc.nick):
+            self._watch_channel(msg.args[0])
+            self._schedule_replay()
+
+    def do001(self, irc, msg):
+        self._schedule_replay()
+
+    def _schedule_replay(self):
+        """Replays the spool shortly, once the bot is done joining
+        channels"""
+        if self._spool is None or self._replay_event is not None:
+            return
+        self._replay_event = schedule.addEvent(self._replay_spool,
+                                               time.time() + 2)
+
+    def _replay_spool(self):
+        self._replay_event = None
+        (delivered, kept, expired) = self._spool.replay(
+            self._service.deliver_spooled,
+            self.registryValue('spool.max-age'))
+        if delivered or expired:
+            self.log.info('Taiga: Replayed %i spooled notifications, %i '
+                          'expired and %i are still waiting.',
+                          delivered, expired, kept)
+
     def _load_projects(self, channel):
+        if self._store is not None:
+            return dict((project_id, dict(project)) for (project_id, project)
+                        in self._snapshot.get(channel, {}).items())
         projects = self.registryValue('projects', channel)
         if projects is None:
             return {}
@@ -235,8 +1200,49 @@ class Taiga(callbacks.Plugin):
             return projects
 
     def _save_projects(self, projects, channel):
+        if self._store is not None:
+            self._store.save(channel, projects)
+            projects = dict((str(project_id), dict(project))
+                            for (project_id, project) in projects.items())
+            if projects:
+                self._snapshot[channel] = projects
+            else:
+                self._snapshot.pop(channel, None)
+            self._index.update(channel, projects)
+            return
+        self._watch_channel(channel)
         self.setRegistryValue('projects', value=projects, channel=channel)
 
+    def _where(self, project_id):
+        """Returns the sorted (channel, slug) of the subscriptions to
+        <project_id>, with the network if they are network-specific"""
+        if self._store is not None:
+            return [(network + '/' + channel if network else channel, slug)
+                    for (network, channel, slug)
+                    in self._store.where(project_id)]
+        return sorted((channel, project['slug']) for (channel, project)
+                      in self._index.lookup(project_id))
+
+    def _get_stats(self):
+        extra = {}
+        if self._shard is not None:
+            extra['shard'] = {
+                'self': self._shard.self_url,
+                'alive': self._shard.alive(),
+            }
+        if self._api is not None:
+            extra['lookups'] = {
+                'hits': self._api.cache.hits,
+                'misses': self._api.cache.misses,
+            }
+        return self._stats.snapshot(queue={
+            'size': self._queue.qsize(),
+            'dropped': self._queue.dropped,
+        }, dedup={
+            'hits': self._dedup.hits,
+            'misses': self._dedup.misses,
+        }, **extra)
+
     def _check_capability(self, irc, msg):
         if ircdb.checkCapability(msg.prefix, 'admin'):
             return True
@@ -247,6 +1253,91 @@ class Taiga(callbacks.Plugin):
     class taiga(callbacks.Commands):
         """Taiga commands"""
 
+        @internationalizeDocstring
+        def stats(self, irc, msg, args):
+            """takes no arguments
+
+            Returns the counters and latencies of the webhook pipeline.
+            They are also available as JSON at /taiga/stats on the HTTP
+            server.
+            """
+            if not instance._check_capability(irc, msg):
+                return
+
+            lines = instance._stats.summary()
+            lines.append('queue=%i' % instance._queue.qsize())
+            irc.reply('; '.join(lines))
+
+        stats = wrap(stats)
+
+        class profile(callbacks.Commands):
+            """Profiling commands"""
+
+            @internationalizeDocstring
+            def start(self, irc, msg, args, optlist):
+                """[--events <n>] [--seconds <n>] [--memory]
+
+                Profiles the handling of webhook requests and notifications
+                with cProfile, and the memory allocations with tracemalloc
+                if --memory is given, until <n> notifications were handled
+                or for <n> seconds (defaults to 1000 notifications and 60
+                seconds). The results are written to the data directory.
+                """
+                if not instance._check_capability(irc, msg):
+                    return
+
+                options = dict(optlist)
+                with instance._profile_lock:
+                    if instance._profiler is not None and \
+                            instance._profiler.running:
+                        irc.error(_('A profile is already running.'))
+                        return
+                    instance._start_profile(
+                        options.get('events', PROFILE_EVENTS),
+                        options.get('seconds', PROFILE_SECONDS),
+                        'memory' in options)
+                irc.replySuccess()
+
+            start = wrap(start, [getopts({'events': 'positiveInt',
+                                          'seconds': 'positiveInt',
+                                          'memory': ''})])
+
+            @internationalizeDocstring
+            def stop(self, irc, msg, args):
+                """takes no arguments
+
+                Stops the running profile and returns its summary.
+                """
+                if not instance._check_capability(irc, msg):
+                    return
+
+                summary = instance._stop_profile()
+                if summary is None:
+                    irc.error(_('No profile is running.'))
+                    return
+                irc.reply(summary)
+
+            stop = wrap(stop)
+
+            @internationalizeDocstring
+            def dump(self, irc, msg, args):
+                """takes no arguments
+
+                Writes the results of the running or last profile to the
+                data directory and returns their summary: the functions that
+                took the most time by themselves and, with --memory, the
+                lines that allocated the most memory still in use.
+                """
+                if not instance._check_capability(irc, msg):
+                    return
+
+                if instance._profiler is None:
+                    irc.error(_('Nothing was profiled yet.'))
+                    return
+                irc.reply(instance._dump_profile(instance._profiler))
+
+            dump = wrap(dump)
+
         class project(callbacks.Commands):
             """Project commands"""
 
@@ -260,6 +1351,7 @@ class Taiga(callbacks.Plugin):
                 if not instance._check_capability(irc, msg):
                     return
 
+                project_id = str(project_id)
                 projects = instance._load_projects(channel)
                 if project_id in projects:
                     irc.error(_('This project is already announced to this channel.'))
@@ -268,9 +1360,12 @@ class Taiga(callbacks.Plugin):
                 # Save new project mapping
                 projects[project_id] = {
                     'slug': project_slug,
-                    'url': taiga_host + '/project/' + project_slug
+                    'url': project_url(taiga_host, project_slug)
                 }
                 instance._save_projects(projects, channel)
+                if instance._api is not None:
+                    instance._api.prefetch(projects[project_id]['url'],
+                                           project_id)
 
                 irc.replySuccess()
 
@@ -300,10 +1395,12 @@ class Taiga(callbacks.Plugin):
             remove = wrap(remove, ['channel', 'somethingWithoutSpaces'])
 
             @internationalizeDocstring
-            def list(self, irc, msg, args, channel):
-                """[<channel>]
+            def list(self, irc, msg, args, channel, optlist):
+                """[<channel>] [--page <n>] [--slug <text>] [--host <text>]
 
-                Lists the registered projects in <channel>.
+                Lists the ids and slugs of the projects registered in
+                <channel> by host, a page at a time. --slug and --host only
+                list the projects whose slug or host contain <text>.
                 """
                 if not instance._check_capability(irc, msg):
                     return
@@ -313,11 +1410,132 @@ class Taiga(callbacks.Plugin):
                     irc.error(_('This channel has no registered projects.'))
                     return
 
-                for project_id, project_data in projects.items():
-                    irc.reply("%s: %s (%s)" % (project_id, project_data['slug'], project_data['url']))
+                options = dict(optlist)
+                page = options.get('page', 1)
+                slug = options.get('slug', '').lower()
+                host = options.get('host', '').lower()
+                matches = sorted(
+                    (project_host(project), sort_key(project_id), project_id,
+                     project['slug'])
+                    for (project_id, project) in projects.items()
+                    if slug in project['slug'].lower() and
+                    host in project_host(project).lower())
+                if not matches:
+                    irc.error(_('No registered project matches.'))
+                    return
+
+                pages = (len(matches) - 1) // LIST_PAGE_SIZE + 1
+                if page > pages:
+                    irc.error(_('There are only %i pages.') % pages)
+                    return
+                start = (page - 1) * LIST_PAGE_SIZE
+                # Group the projects of a page by host
+                groups = []
+                for (taiga_host, _key, project_id, project_slug) \
+                        in matches[start:start + LIST_PAGE_SIZE]:
+                    if not groups or groups[-1][0] != taiga_host:
+                        groups.append((taiga_host, []))
+                    groups[-1][1].append('%s %s' % (project_id, project_slug))
+                reply = '; '.join('%s: %s' % (taiga_host, ', '.join(items))
+                                  for (taiga_host, items) in groups)
+                if pages > 1:
+                    reply += _(' (page %i/%i, %i projects)') % (
+                        page, pages, len(matches))
+                irc.reply(reply)
+
+            list = wrap(list, ['channel', getopts({'page': 'positiveInt',
+                                                   'slug': 'something',
+                                                   'host': 'something'})])
+
+            @internationalizeDocstring
+            def where(self, irc, msg, args, project_id):
+                """<project-id>
+
+                Lists the channels the project with the id <project-id> is
+                announced to.
+                """
+                if not instance._check_capability(irc, msg):
+                    return
+
+                subscriptions = instance._where(project_id)
+                if not subscriptions:
+                    irc.error(_('This project is not announced to any '
+                                'channel.'))
+                    return
+                irc.reply(', '.join('%s (%s)' % subscription
+                                    for subscription in subscriptions))
+
+            where = wrap(where, ['id'])
+
+            @internationalizeDocstring
+            def import_(self, irc, msg, args, channel, optlist, data):
+                """[<channel>] [--replace] <url|data>
+
+                Subscribes <channel> to the projects in the document at <url>,
+                or in <data>, in a single change. They are given as JSON, like
+                the output of the export command, or as CSV rows of id, slug
+                and host separated by spaces. With --replace, the other
+                projects of <channel> are removed.
+                """
+                if not instance._check_capability(irc, msg):
+                    return
+
+                match = utils.web.httpUrlRe.match(data)
+                if match and match.group(0) == data:
+                    try:
+                        data = utils.web.getUrl(data, size=IMPORT_MAX_SIZE,
+                                                timeout=10)
+                        data = data.decode('utf-8')
+                    except (utils.web.Error, UnicodeDecodeError) as e:
+                        irc.error(_('Could not fetch the projects: %s') % e)
+                        return
+
+                try:
+                    imported = parse_projects(data)
+                except ValueError as e:
+                    irc.error(str(e))
+                    return
+                if not imported:
+                    irc.error(_('No projects to import.'))
+                    return
+
+                projects = {} if ('replace', True) in optlist else \
+                    instance._load_projects(channel)
+                updated = sum(1 for project_id in imported
+                              if project_id in projects)
+                projects.update(imported)
+                instance._save_projects(projects, channel)
+                if instance._api is not None:
+                    for (project_id, project) in imported.items():
+                        instance._api.prefetch(project['url'], project_id)
+
+                irc.reply(_('Imported %i projects (%i updated), %i are '
+                            'announced to %s.') % (len(imported), updated,
+                                                   len(projects), channel))
+
+            import_ = wrap(import_, ['channel', getopts({'replace': ''}),
+                                     'text'])
+
+            @internationalizeDocstring
+            def export(self, irc, msg, args, channel, optlist):
+                """[<channel>] [--csv]
+
+                Returns the projects registered in <channel> as JSON, or as
+                CSV rows of id, slug and host with --csv.
+                """
+                if not instance._check_capability(irc, msg):
+                    return
+
+                projects = instance._load_projects(channel)
+                format = 'csv' if ('csv', True) in optlist else 'json'
+                irc.reply(export_projects(projects, format))
+
+            export = wrap(export, ['channel', getopts({'csv': ''})])
 
-            list = wrap(list, ['channel'])
 
+# 'import' is a keyword, so the method cannot be defined with its name
+setattr(Taiga.taiga.project, 'import', Taiga.taiga.project.import_)
+del Taiga.taiga.project.import_
 
 Class = Taiga
 
@@ -0,0 +1,236 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import os
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# Allocations of the import machinery and of the profilers themselves are
+# noise
+_NOISE = (
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+# Held while a call is profiled
+_profiling = threading.Lock()
+
+
+class Profiler(object):
+    """Profiles the calls of the attached methods with cProfile, and the
+    allocations made meanwhile with tracemalloc if <memory> is set, until
+    <max_events> counted calls returned or stop() is called. <on_limit> is
+    called once the limit is reached. Calls are profiled one at a time, the
+    calls made meanwhile in other threads are counted as skipped."""
+
+    def __init__(self, max_events, memory=False, frames=10, on_limit=None):
+        self.max_events = max_events
+        self.memory = memory
+        self.frames = frames
+        self.on_limit = on_limit
+        self.events = 0
+        self.skipped = 0
+        self.running = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = None
+        self._patched = []
+        self._start_snapshot = None
+        self._snapshot = None
+        self._traced = False
+
+    def attach(self, obj, name, count=False):
+        """Profiles the calls of the method <name> of <obj> until stop(),
+        counting them as events if <count> is set"""
+        original = obj.__dict__.get(name)
+        function = getattr(obj, name)
+
+        def profiled(*args, **kwargs):
+            return self._call(function, count, args, kwargs)
+        setattr(obj, name, profiled)
+        self._patched.append((obj, name, original))
+
+    def start(self):
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._traced = True
+            self._start_snapshot = self._take_snapshot()
+        self.running = True
+
+    def stop(self):
+        """Restores the attached methods, returns False if the profiler
+        was already stopped"""
+        with self._lock:
+            if not self.running:
+                return False
+            self.running = False
+            for (obj, name, original) in reversed(self._patched):
+                if original is None:
+                    delattr(obj, name)
+                else:
+                    setattr(obj, name, original)
+            self._patched = []
+        if self.memory:
+            self._snapshot = self._take_snapshot()
+            if self._traced:
+                tracemalloc.stop()
+                self._traced = False
+        return True
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(_NOISE)
+
+    def _call(self, function, count, args, kwargs):
+        if not self.running:
+            return function(*args, **kwargs)
+        local = self._local
+        # The calls made by a profiled call are profiled with it
+        outermost = not getattr(local, 'active', False)
+        profile = None
+        if outermost:
+            local.active = True
+            profile = self._enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+                _profiling.release()
+            if outermost:
+                local.active = False
+            with self._lock:
+                if profile is not None:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+                elif outermost:
+                    self.skipped += 1
+                if count:
+                    self.events += 1
+                # Stopping is left to the outermost call, so that it is not
+                # profiled
+                limit = outermost and self.running and \
+                    self.events >= self.max_events
+            if limit and self.on_limit is not None:
+                self.on_limit()
+
+    def _enable(self):
+        """Returns an enabled profile, or None if another thread is being
+        profiled"""
+        # Since Python 3.12, a single profile can be enabled at once in the
+        # whole process
+        if not _profiling.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is active
+            _profiling.release()
+            return None
+        return profile
+
+    def top_functions(self, limit=5):
+        """Returns the (function, calls, seconds) of the <limit> functions
+        that took the most time by themselves"""
+        with self._lock:
+            if self._stats is None:
+                return []
+            items = list(self._stats.stats.items())
+        functions = []
+        for ((filename, line, name), (cc, calls, tottime, cumtime, callers)) \
+                in items:
+            if '_lsprof' in name or filename == __file__:
+                # The profiler itself
+                continue
+            if filename != '~':
+                name = '%s:%i(%s)' % (os.path.basename(filename), line, name)
+            functions.append((name, calls, tottime))
+        functions.sort(key=lambda function: function[2], reverse=True)
+        return functions[:limit]
+
+    def snapshot_diff(self):
+        """Returns the tracemalloc statistics of the allocations made since
+        start(), by line, or None if memory is not profiled"""
+        if not self.memory:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self._take_snapshot()
+        return snapshot.compare_to(self._start_snapshot, 'lineno')
+
+    def top_allocations(self, limit=5):
+        """Returns the (site, size, blocks) of the <limit> lines that
+        allocated the most memory still in use"""
+        diff = self.snapshot_diff()
+        if diff is None:
+            return []
+        allocations = []
+        for stat in diff:
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            allocations.append(('%s:%i' % (os.path.basename(frame.filename),
+                                           frame.lineno),
+                                stat.size_diff, stat.count_diff))
+            if len(allocations) == limit:
+                break
+        return allocations
+
+    def dump(self, path):
+        """Writes the profile to <path>, readable with the pstats module,
+        and the allocations to <path>.allocations. Returns the written paths."""
+        paths = []
+        with self._lock:
+            if self._stats is not None:
+                self._stats.dump_stats(path)
+                paths.append(path)
+        diff = self.snapshot_diff()
+        if diff is not None:
+            with open(path + '.allocations', 'w') as fd:
+                for stat in diff:
+                    if stat.size_diff > 0:
+                        fd.write('%s\n' % stat)
+                        for line in stat.traceback.format():
+                            fd.write('%s\n' % line)
+            paths.append(path + '.allocations')
+        return paths
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
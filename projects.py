@@ -0,0 +1,131 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import io
+import csv
+import json
+import urllib.parse
+
+try:
+    from supybot.i18n import PluginInternationalization
+    _ = PluginInternationalization('Taiga')
+except ImportError:
+    # Placeholder that allows to run the plugin on a bot
+    # without the i18n module
+    def _(x):
+        return x
+
+
+def project_url(taiga_host, project_slug):
+    return taiga_host.rstrip('/') + '/project/' + project_slug
+
+
+def project_host(project):
+    """Returns the Taiga host of a project mapping"""
+    url = project['url']
+    suffix = '/project/' + project['slug']
+    if url.endswith(suffix):
+        return url[:-len(suffix)]
+    return url
+
+
+def sort_key(project_id):
+    """Sorts project ids numerically"""
+    return (len(project_id), project_id)
+
+
+def _mapping(project_id, project_slug, taiga_host=None, url=None):
+    project_id = str(project_id).strip()
+    if not project_id.isdigit():
+        raise ValueError(_('Invalid project id: %r') % project_id)
+    if not project_slug or any(c.isspace() for c in project_slug):
+        raise ValueError(_('Invalid project slug: %r') % project_slug)
+    if url is None:
+        url = project_url(taiga_host or '', project_slug)
+    if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+        raise ValueError(_('Invalid url for project %s: %r') %
+                         (project_id, url))
+    return (project_id, {'slug': project_slug, 'url': url})
+
+
+def parse_projects(text):
+    """Parses project mappings given as JSON, either like the projects value
+    or as a list of objects with an id, a slug and a host, or as CSV rows of
+    id, slug and host separated by newlines or spaces. Raises ValueError on
+    invalid data."""
+    text = text.strip()
+    projects = {}
+    if text[:1] in ('{', '['):
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ValueError(_('Invalid JSON: %s') % e)
+        try:
+            if isinstance(data, dict):
+                items = [_mapping(project_id, project['slug'],
+                                  url=project['url'])
+                         for (project_id, project) in data.items()]
+            else:
+                items = [_mapping(project['id'], project['slug'],
+                                  project.get('host'), project.get('url'))
+                         for project in data]
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError(_('Projects need an id, a slug and a host or '
+                               'url.'))
+        projects.update(items)
+        return projects
+
+    rows = csv.reader(io.StringIO('\n'.join(text.split())))
+    for (number, row) in enumerate(rows, 1):
+        if number == 1 and row and row[0].strip().lower() == 'id':
+            continue
+        if len(row) != 3:
+            raise ValueError(_('Row %i: expected id,slug,host') % number)
+        (project_id, project) = _mapping(row[0], row[1].strip(),
+                                         row[2].strip())
+        projects[project_id] = project
+    return projects
+
+
+def export_projects(projects, format='json'):
+    """Returns <projects> as compact JSON, that can be imported back, or as
+    CSV rows of id, slug and host"""
+    if format == 'json':
+        return json.dumps(projects, sort_keys=True, separators=(',', ':'))
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator=' ')
+    writer.writerow(['id', 'slug', 'host'])
+    for project_id in sorted(projects, key=sort_key):
+        project = projects[project_id]
+        writer.writerow([project_id, project['slug'], project_host(project)])
+    return output.getvalue().strip()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,261 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import io
+import asyncio
+import threading
+import concurrent.futures
+import http.client
+import http.server
+
+import supybot.log as log
+import supybot.world as world
+
+# Size of the chunks request bodies are read in
+CHUNK_SIZE = 64 * 1024
+
+# Limits of the header lines of a request, which are read before the
+# admission control applies
+MAX_HEADER_SIZE = 64 * 1024
+MAX_HEADERS = 100
+
+# Number of threads handling the requests away from the event loop, as
+# receiving one may wait for the journal, the enrichment of an inline payload
+# or another instance it is forwarded to
+HANDLER_THREADS = 16
+
+
+class Response(object):
+    """Collects the response written by the webhook service, in the
+    interface of the request handlers of supybot's HTTP server"""
+
+    def __init__(self, headers, client_address):
+        self.headers = headers
+        self.client_address = client_address
+        self.wfile = io.BytesIO()
+        self.code = 500
+        self.sent_headers = []
+
+    def send_response(self, code):
+        self.code = code
+
+    def send_header(self, name, value):
+        self.sent_headers.append((name, str(value)))
+
+    def end_headers(self):
+        pass
+
+    def encode(self, keep_alive):
+        body = self.wfile.getvalue()
+        reason = http.server.BaseHTTPRequestHandler.responses.get(
+            self.code, ('',))[0]
+        lines = ['HTTP/1.1 %i %s' % (self.code, reason)]
+        lines.extend('%s: %s' % header for header in self.sent_headers
+                     if header[0].lower() not in ('content-length',
+                                                  'connection'))
+        lines.append('Content-Length: %i' % len(body))
+        lines.append('Connection: %s' % ('keep-alive' if keep_alive
+                                         else 'close'))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+class AsyncReceiver(object):
+    """An HTTP/1.1 server receiving the webhooks on its own port, in an
+    asyncio event loop running in its own thread. Connections are kept
+    alive for <timeout> seconds and at most <max_connections> of them are
+    served at once, the others wait."""
+
+    def __init__(self, service, host, port, max_connections, timeout):
+        self.service = service
+        self.host = host or None
+        self.port = port
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.log = log.getPluginLogger('Taiga')
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._error = None
+        self._executor = None
+
+    def start(self):
+        """Starts listening, raises if the port cannot be bound"""
+        self._thread = world.SupyThread(target=self._run,
+                                        name='Taiga receiver')
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self, timeout=5):
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+
+    def _run(self):
+        self._loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+            self._server = loop.run_until_complete(asyncio.start_server(
+                self._serve, self.host, self.port, limit=CHUNK_SIZE))
+            self.port = self._server.sockets[0].getsockname()[1]
+        except Exception as e:
+            self._error = e
+            self._started.set()
+            loop.close()
+            return
+        self._started.set()
+        self.log.info('Taiga: Receiving webhooks on port %i.', self.port)
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            HANDLER_THREADS, thread_name_prefix='Taiga receiver')
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks,
+                                                   return_exceptions=True))
+            loop.close()
+            self._executor.shutdown(wait=False)
+
+    async def _serve(self, reader, writer):
+        try:
+            async with self._semaphore:
+                keep_alive = True
+                while keep_alive:
+                    keep_alive = await self._serve_request(reader, writer)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.CancelledError, ConnectionError, ValueError,
+                http.client.HTTPException):
+            # Idle, closed or garbled connections, or stopping
+            pass
+        except Exception:
+            self.log.exception('Taiga: Error while receiving a webhook.')
+        finally:
+            writer.close()
+
+    async def _serve_request(self, reader, writer):
+        """Serves a request of the connection, returns whether it can be
+        kept alive"""
+        request_line = await asyncio.wait_for(reader.readline(),
+                                              self.timeout)
+        if not request_line.strip():
+            return False
+        (method, target, version) = \
+            request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        head = bytearray()
+        count = 0
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if not line:
+                return False
+            head += line
+            if line in (b'\r\n', b'\n'):
+                break
+            count += 1
+            if len(head) > MAX_HEADER_SIZE or count > MAX_HEADERS:
+                await self._send_status(writer, 431)
+                return False
+        try:
+            headers = http.client.parse_headers(io.BytesIO(bytes(head)))
+        except http.client.HTTPException:
+            await self._send_status(writer, 400)
+            return False
+
+        connection = headers.get('Connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' \
+            else connection == 'keep-alive'
+
+        path = target.split('?', 1)[0]
+        if path.startswith('/taiga/'):
+            path = path[len('/taiga'):]
+        response = Response(headers, writer.get_extra_info('peername'))
+        if method == 'POST':
+            length = headers.get('Content-Length')
+            if length is None or not length.isdigit():
+                response.send_response(411)
+                keep_alive = False
+            elif not self.service.admit(response, path):
+                # The body is left unread
+                keep_alive = False
+            else:
+                try:
+                    if headers.get('Expect', '').lower() == '100-continue':
+                        writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                    mac = self.service.signature_mac(path)
+                    body = await self._read_body(reader, int(length), mac)
+                    await asyncio.get_running_loop().run_in_executor(
+                        self._executor, self.service.receive, response, path,
+                        body, mac)
+                finally:
+                    self.service.release()
+        elif method == 'GET' and path == '/stats':
+            self.service.doGet(response, path)
+        else:
+            response.send_response(405)
+            response.send_header('Content-type', 'text/plain')
+            response.wfile.write(self.service.defaultResponse.encode('utf-8'))
+
+        writer.write(response.encode(keep_alive))
+        await writer.drain()
+        return keep_alive
+
+    async def _send_status(self, writer, code):
+        """Answers a request that is not handled with <code> and an empty
+        body, closing the connection"""
+        response = Response(None, None)
+        response.send_response(code)
+        writer.write(response.encode(False))
+        await writer.drain()
+
+    async def _read_body(self, reader, length, mac=None):
+        """Reads the body of a request as it arrives, updating <mac> with
+        it"""
+        body = bytearray()
+        while len(body) < length:
+            chunk = await asyncio.wait_for(
+                reader.read(min(CHUNK_SIZE, length - len(body))),
+                self.timeout)
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(body), length)
+            if mac is not None:
+                mac.update(chunk)
+            body += chunk
+        # Not copied into bytes, the body is only read from now on
+        return body
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
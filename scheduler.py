@@ -0,0 +1,218 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import time
+import heapq
+import itertools
+import threading
+import collections
+
+import supybot.ircmsgs as ircmsgs
+import supybot.schedule as schedule
+try:
+    from supybot.i18n import PluginInternationalization
+    _ = PluginInternationalization('Taiga')
+except ImportError:
+    # Placeholder that allows to run the plugin on a bot
+    # without the i18n module
+    def _(x):
+        return x
+
+
+ACTION_PRIORITIES = {'created': 0, 'deleted': 0, 'changed': 1}
+TYPE_PRIORITIES = {'issue': 0, 'wikipage': 2}
+
+
+def priority(format_string_identifier):
+    """Returns the priority of the announcements made with the given format,
+    lower is more important: creations and deletions beat changes, issues
+    beat the other items and wikipages come last."""
+    name = format_string_identifier.split('.')[-1]
+    (kind, _sep, action) = name.rpartition('-')
+    return (ACTION_PRIORITIES.get(action, 1), TYPE_PRIORITIES.get(kind, 1))
+
+
+def _batch(lines, max_targets, max_length=450):
+    """Returns PRIVMSGs sending each distinct text of the (channel, text)
+    <lines> to as many channels at once as the server allows"""
+    targets = collections.OrderedDict()
+    for (channel, text) in lines:
+        targets.setdefault(text, []).append(channel)
+    msgs = []
+    for (text, channels) in targets.items():
+        batch = []
+        for channel in channels:
+            if batch and (len(batch) >= max_targets or
+                          len(text) + len(','.join(batch + [channel])) >
+                          max_length):
+                msgs.append(ircmsgs.privmsg(','.join(batch), text))
+                batch = []
+            batch.append(channel)
+        msgs.append(ircmsgs.privmsg(','.join(batch), text))
+    return msgs
+
+
+class _ChannelQueue(object):
+    __slots__ = ('tokens', 'stamp', 'rate', 'burst', 'pending', 'suppressed')
+
+    def __init__(self, rate, burst):
+        self.tokens = burst
+        self.stamp = time.time()
+        self.rate = rate
+        self.burst = burst
+        self.pending = []
+        self.suppressed = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+
+class OutboundScheduler(object):
+    """Sits in front of queueMsg: every channel gets a token bucket, channels
+    take turns, important announcements go first and the least important
+    lines of an overflowing backlog are replaced by a summary. The same line
+    sent to several channels in a turn becomes a single PRIVMSG to up to
+    <max_targets>() channels."""
+
+    def __init__(self, queue_msg, settings, max_targets=lambda: 1,
+                 interval=0.5):
+        self.queue_msg = queue_msg
+        self.settings = settings
+        self.max_targets = max_targets
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._ready = collections.deque()
+        self._counter = itertools.count()
+        self._event = None
+
+    def start(self):
+        self._event = schedule.addPeriodicEvent(
+            self.run, self.interval, name='Taiga scheduler %i' % id(self),
+            now=False)
+
+    def stop(self):
+        """Stops the periodic event and sends the whole backlog"""
+        if self._event is not None:
+            try:
+                schedule.removePeriodicEvent(self._event)
+            except KeyError:
+                pass
+            self._event = None
+        msgs = []
+        with self._lock:
+            for channel in self._ready:
+                state = self._channels[channel]
+                if state.suppressed:
+                    msgs.append(ircmsgs.privmsg(channel,
+                        _('%i more events suppressed') % state.suppressed))
+                for (_priority, _count, text) in sorted(state.pending):
+                    msgs.append(ircmsgs.privmsg(channel, text))
+            self._channels.clear()
+            self._ready.clear()
+        for msg in msgs:
+            self.queue_msg(msg)
+
+    def send(self, channel, priority, text):
+        self._enqueue(channel, priority, text)
+        self.run()
+
+    def send_all(self, channels, priority, text):
+        """Sends <text> to each of <channels>, in as few lines as the
+        server allows"""
+        for channel in channels:
+            self._enqueue(channel, priority, text)
+        self.run()
+
+    def _enqueue(self, channel, priority, text):
+        (rate, burst, backlog) = self.settings(channel)
+        with self._lock:
+            state = self._channels.get(channel)
+            if state is None:
+                state = self._channels[channel] = _ChannelQueue(rate, burst)
+                self._ready.append(channel)
+            elif not state.pending and not state.suppressed:
+                self._ready.append(channel)
+            (state.rate, state.burst) = (rate, burst)
+            heapq.heappush(state.pending,
+                           (priority, next(self._counter), text))
+            if len(state.pending) > backlog:
+                # Suppress the least important line, the oldest of them if
+                # they are equally important
+                worst = max(range(len(state.pending)),
+                            key=lambda i: (state.pending[i][0],
+                                           -state.pending[i][1]))
+                state.pending[worst] = state.pending[-1]
+                state.pending.pop()
+                heapq.heapify(state.pending)
+                state.suppressed += 1
+
+    def pending(self, channel):
+        with self._lock:
+            state = self._channels.get(channel)
+            return len(state.pending) if state is not None else 0
+
+    def run(self):
+        """Sends what the token buckets allow, one line per channel in
+        turn"""
+        now = time.time()
+        max_targets = self.max_targets()
+        msgs = []
+        with self._lock:
+            progress = True
+            while progress:
+                progress = False
+                # A channel sends at most one line per turn, so merging the
+                # lines of a turn does not reorder them
+                lines = []
+                for i in range(len(self._ready)):
+                    channel = self._ready.popleft()
+                    state = self._channels[channel]
+                    state.refill(now)
+                    if state.tokens >= 1:
+                        state.tokens -= 1
+                        progress = True
+                        if state.suppressed:
+                            text = _('%i more events suppressed') % \
+                                state.suppressed
+                            state.suppressed = 0
+                        else:
+                            text = heapq.heappop(state.pending)[2]
+                        lines.append((channel, text))
+                    if state.pending or state.suppressed:
+                        self._ready.append(channel)
+                msgs.extend(_batch(lines, max_targets))
+        for msg in msgs:
+            self.queue_msg(msg)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,193 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import hmac
+import time
+import bisect
+import hashlib
+import threading
+
+import supybot.log as log
+import supybot.world as world
+
+# Marks the requests forwarded by another instance, which are never
+# forwarded again. Its value is the url of the instance, the time and an
+# HMAC of both and of the path, keyed with the shared secret.
+FORWARDED_HEADER = 'X-Taiga-Forwarded-By'
+
+# Number of seconds a forwarded request is accepted for, which allows for
+# the clocks of the instances to differ
+FORWARD_MAX_AGE = 60
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8],
+                          'big')
+
+
+class HashRing(object):
+    """Assigns keys to nodes by consistent hashing, each node being placed
+    at <replicas> points of the ring so that adding or removing one only
+    moves its share of the keys"""
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash('%s#%i' % (node, i)), node)
+                        for node in self.nodes for i in range(replicas))
+        self._hashes = [point for (point, node) in points]
+        self._nodes = [node for (point, node) in points]
+
+    def owner(self, key):
+        """Returns the node owning <key>, or None if there is none"""
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
+
+
+class ShardRouter(object):
+    """Decides which of the instances sharing the webhook endpoint, listed
+    by the base url of their webhooks, handles the notifications of a
+    project, and forwards them to it. Instances that do not answer are
+    taken out of the ring until they answer again."""
+
+    def __init__(self, self_url, peers, pool, secret, replicas=100):
+        self.self_url = self_url
+        self.pool = pool
+        self.secret = secret.encode('utf-8')
+        self.replicas = replicas
+        self.log = log.getPluginLogger('Taiga')
+        self._lock = threading.Lock()
+        self._checking = False
+        self.set_peers(peers)
+
+    def set_peers(self, peers):
+        """Replaces the instances, e.g. when one joins, assuming they are
+        all alive until checked"""
+        with self._lock:
+            self.peers = frozenset(peers) | frozenset([self.self_url])
+            self._down = set()
+            self._rebuild()
+
+    def _rebuild(self):
+        self.ring = HashRing(self.peers - self._down, self.replicas)
+
+    def alive(self):
+        return sorted(self.peers - self._down)
+
+    def owner(self, project_id):
+        """Returns the url of the instance owning <project_id>, or None if
+        it is this one"""
+        owner = self.ring.owner(str(project_id))
+        return None if owner == self.self_url else owner
+
+    def mark(self, peer, alive):
+        with self._lock:
+            if alive == (peer not in self._down) or peer not in self.peers:
+                return
+            if alive:
+                self._down.discard(peer)
+            else:
+                self._down.add(peer)
+            self._rebuild()
+        self.log.info('Taiga: Instance %s %s, rebalancing the projects.',
+                      peer, 'is back' if alive else 'does not answer')
+
+    def _mac(self, peer, stamp, path):
+        return hmac.new(self.secret, ('%s %s %s' % (peer, stamp, path))
+                        .encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def sign(self, path):
+        """Returns the value of the FORWARDED_HEADER of a request to
+        <path>"""
+        stamp = str(int(time.time()))
+        return '%s %s %s' % (self.self_url, stamp,
+                             self._mac(self.self_url, stamp, path))
+
+    def verify(self, value, path):
+        """Returns the instance that forwarded a request to <path> with the
+        FORWARDED_HEADER <value>, or None if it is not authentic"""
+        try:
+            (peer, stamp, mac) = (value or '').split(' ')
+            age = abs(time.time() - int(stamp))
+        except ValueError:
+            return None
+        if peer not in self.peers or peer == self.self_url or \
+                age > FORWARD_MAX_AGE:
+            return None
+        if not hmac.compare_digest(self._mac(peer, stamp, path)
+                                   .encode('ascii'), mac.encode('utf-8')):
+            return None
+        return peer
+
+    def forward(self, project_id, path, body, headers):
+        """Sends a notification of <project_id> to the instance owning it,
+        failing over to the next owner if it does not answer. Returns the
+        status and the body of the response, or None if the notification
+        belongs to this instance."""
+        headers = dict(headers)
+        headers[FORWARDED_HEADER] = self.sign(path)
+        while True:
+            owner = self.owner(project_id)
+            if owner is None:
+                return None
+            try:
+                return self.pool.request('POST', owner + path, body, headers)
+            except Exception as e:
+                self.log.warning('Taiga: Could not forward to %s: %s',
+                                 owner, e)
+                self.mark(owner, False)
+
+    def check(self):
+        """Checks in a thread which instances answer"""
+        with self._lock:
+            if self._checking:
+                return
+            self._checking = True
+        thread = world.SupyThread(target=self._check, name='Taiga shards')
+        thread.daemon = True
+        thread.start()
+
+    def _check(self):
+        try:
+            for peer in self.peers - frozenset([self.self_url]):
+                try:
+                    (status, body) = self.pool.request('GET', peer + '/stats')
+                    alive = status == 200
+                except Exception:
+                    alive = False
+                self.mark(peer, alive)
+        finally:
+            with self._lock:
+                self._checking = False
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
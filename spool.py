@@ -0,0 +1,185 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import os
+import time
+import zlib
+import struct
+import threading
+
+import supybot.log as log
+
+# crc32, timestamp, length of the target, length of the body
+_HEADER = struct.Struct('>IdHI')
+
+
+class Spool(object):
+    """Append-only journal of verified notifications that could not be
+    announced yet, split in segments of about <segment_size> bytes. The
+    oldest segments are deleted when the journal grows over <budget>
+    bytes. Segments are synced to disk when they are closed, and every
+    record is if <fsync> is set; otherwise the last records only survive a
+    restart of the process, not a crash of the machine."""
+
+    def __init__(self, directory, segment_size, budget, fsync=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.budget = budget
+        self.fsync = fsync
+        self.log = log.getPluginLogger('Taiga')
+        self._lock = threading.Lock()
+        self._file = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._segments = sorted(name for name in os.listdir(directory)
+                                if name.endswith('.seg'))
+        self._size = sum(os.path.getsize(self._path(segment))
+                         for segment in self._segments)
+        if self._segments:
+            self._counter = int(self._segments[-1].split('.')[0]) + 1
+        else:
+            self._counter = 0
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def size(self):
+        """Returns the size of the journal in bytes"""
+        return self._size
+
+    def append(self, network, channel, body, timestamp=None):
+        target = ('%s\x00%s' % (network, channel)).encode('utf-8')
+        if timestamp is None:
+            timestamp = time.time()
+        record = target + body
+        header = _HEADER.pack(zlib.crc32(record), timestamp, len(target),
+                              len(body))
+        with self._lock:
+            self._write(header + record)
+
+    def _write(self, data):
+        if self._file is None or \
+                self._file.tell() + len(data) > self.segment_size:
+            self._close()
+            segment = '%016i.seg' % self._counter
+            self._counter += 1
+            self._segments.append(segment)
+            self._file = open(self._path(segment), 'ab')
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._size += len(data)
+
+        # Stay within the budget, dropping the oldest notifications
+        while len(self._segments) > 1 and self._size > self.budget:
+            segment = self._segments[0]
+            self.log.warning('Taiga: Spool is over its budget, dropping %s.',
+                             segment)
+            self._remove(segment)
+
+    def _remove(self, segment):
+        path = self._path(segment)
+        self._size -= os.path.getsize(path)
+        os.remove(path)
+        self._segments.remove(segment)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _read(self, segment):
+        """Yields the records of <segment> as (timestamp, network, channel,
+        body, raw record)"""
+        with open(self._path(segment), 'rb') as fd:
+            data = fd.read()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            (crc, timestamp, target_length, body_length) = \
+                _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            end = start + target_length + body_length
+            record = data[start:end]
+            if end > len(data) or zlib.crc32(record) != crc:
+                self.log.warning('Taiga: Truncated or corrupted record in '
+                                 'spool segment %s, skipping the rest of it.',
+                                 segment)
+                return
+            (network, channel) = \
+                record[:target_length].decode('utf-8').split('\x00', 1)
+            yield (timestamp, network, channel, record[target_length:],
+                   data[offset:end])
+            offset = end
+
+    def replay(self, deliver, max_age=0):
+        """Reads the journal in order and calls
+        <deliver>(network, channel, body) for every notification that is not
+        older than <max_age> seconds (if not 0). Notifications for which it
+        returns False are kept for the next replay, the others are removed
+        from the journal. Returns the numbers of delivered, kept and expired
+        notifications."""
+        delivered = kept = expired = 0
+        now = time.time()
+        with self._lock:
+            self._close()
+            if not self._segments:
+                return (0, 0, 0)
+            old_segments = list(self._segments)
+            remaining = []
+            for segment in old_segments:
+                for (timestamp, network, channel, body, raw) in \
+                        self._read(segment):
+                    if max_age and now - timestamp > max_age:
+                        expired += 1
+                    elif deliver(network, channel, body):
+                        delivered += 1
+                    else:
+                        kept += 1
+                        remaining.append(raw)
+
+            # Write the kept notifications before removing the old segments,
+            # so a crash at worst replays some of them twice
+            for raw in remaining:
+                self._write(raw)
+            self._close()
+            for segment in old_segments:
+                if segment in self._segments:
+                    self._remove(segment)
+        return (delivered, kept, expired)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,134 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import threading
+import collections
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, float('inf'))
+
+
+class Histogram(object):
+    """Counts latencies in the fixed BUCKETS"""
+    __slots__ = ('count', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for (i, bound) in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the <q> quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for (bound, count) in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'buckets': [['+Inf' if bound == float('inf') else bound, count]
+                        for (bound, count) in zip(BUCKETS, self.buckets)],
+        }
+
+
+class Stats(object):
+    """Counters and per-stage latency histograms of the webhook pipeline"""
+
+    STAGES = ('verify', 'decode', 'route', 'enrich', 'format', 'queue')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = collections.OrderedDict(
+            (stage, Histogram()) for stage in self.STAGES)
+        self._counters = collections.Counter()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._stages[stage].observe(seconds)
+
+    def incr(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def snapshot(self, **extra):
+        """Returns the counters and histograms as a JSON-serializable dict,
+        together with the <extra> values"""
+        with self._lock:
+            data = {
+                'counters': dict(self._counters),
+                'stages': collections.OrderedDict(
+                    (stage, histogram.to_dict())
+                    for (stage, histogram) in self._stages.items()),
+            }
+        data.update(extra)
+        return data
+
+    def summary(self):
+        """Returns one 'key=value' string per stage"""
+        lines = []
+        with self._lock:
+            for (stage, histogram) in self._stages.items():
+                if histogram.count:
+                    lines.append('%s count=%i avg=%.3fms p50<=%sms '
+                                 'p99<=%sms' % (
+                                     stage, histogram.count,
+                                     histogram.total / histogram.count * 1000,
+                                     _milliseconds(histogram.quantile(0.5)),
+                                     _milliseconds(histogram.quantile(0.99))))
+                else:
+                    lines.append('%s count=0' % stage)
+            lines.extend('%s=%i' % item
+                         for item in sorted(self._counters.items()))
+        return lines
+
+
+def _milliseconds(bound):
+    if bound == float('inf'):
+        return 'inf'
+    return '%g' % (bound * 1000)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
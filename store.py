@@ -0,0 +1,126 @@
+###
+# Copyright (c) 2015, Moritz Lipp
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+###
+
+import sqlite3
+import threading
+import collections
+
+import supybot.ircutils as ircutils
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    network TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    project_id TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    url TEXT NOT NULL,
+    -- Also serves as the index on (network, channel)
+    PRIMARY KEY (network, channel, project_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS subscriptions_project
+    ON subscriptions (project_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SqliteStore(object):
+    """Keeps the project mappings of the channels in an SQLite database.
+    Like the registry value, mappings apply to the channel on every network,
+    they are stored with an empty network."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def migrated(self):
+        """Returns whether the mappings of the registry were imported"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta "
+                                   "WHERE key = 'migrated'").fetchone()
+        return row is not None
+
+    def migrate(self, channels):
+        """Imports the {channel: projects} mappings of the registry, once"""
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO meta (key, value) "
+                             "VALUES ('migrated', '1')")
+            for (channel, projects) in channels.items():
+                self._replace('', channel, projects)
+
+    def load_all(self):
+        """Returns the mappings of all channels, as {channel: projects}"""
+        channels = collections.defaultdict(dict)
+        with self._lock:
+            rows = self._db.execute("SELECT channel, project_id, slug, url "
+                                    "FROM subscriptions WHERE network = ''")
+            for (channel, project_id, slug, url) in rows:
+                channels[channel][project_id] = {'slug': slug, 'url': url}
+        return channels
+
+    def save(self, channel, projects, network=''):
+        """Replaces the mappings of <channel> with <projects>"""
+        with self._lock, self._db:
+            self._replace(network, channel, projects)
+
+    def _replace(self, network, channel, projects):
+        channel = ircutils.toLower(channel)
+        self._db.execute("DELETE FROM subscriptions "
+                         "WHERE network = ? AND channel = ?",
+                         (network, channel))
+        self._db.executemany(
+            "INSERT INTO subscriptions (network, channel, project_id, slug, "
+            "url) VALUES (?, ?, ?, ?, ?)",
+            ((network, channel, str(project_id), project['slug'],
+              project['url'])
+             for (project_id, project) in projects.items()))
+
+    def where(self, project_id):
+        """Returns the (network, channel, slug) of the subscriptions to
+        <project_id>"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT network, channel, slug FROM subscriptions "
+                "WHERE project_id = ? ORDER BY network, channel",
+                (str(project_id),)).fetchall()
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -30,9 +30,1431 @@
 
 from supybot.test import *
 
+import os
+import glob
+import json
+import time
+import hmac
+import shutil
+import socket
+import hashlib
+import collections
+import tempfile
+import threading
+import http.client
+import http.server
+import concurrent.futures
+
+from .admission import AdmissionControl, RateLimiter
+from .api import ConnectionPool, LookupCache, TaigaApi, api_url
+from .bench import FakeHandler, post, sign, run_benchmark, format_results, \
+    compare_baseline, compare_timings
+from .plugin import TaigaHandler, PayloadQueue, DedupCache, Template
+from .scheduler import OutboundScheduler, priority
+from .events import EVENT_TYPES, loads, referenced_fields
+from .filters import EventFilter
+from .profiling import Profiler
+from .receiver import AsyncReceiver
+from .shard import FORWARDED_HEADER, HashRing, ShardRouter
+from .spool import Spool
+from .store import SqliteStore
+
+
+def make_payload(payload_type='userstory', action='create', project_id=1):
+    return {
+        'type': payload_type,
+        'action': action,
+        'data': {
+            'id': 42,
+            'ref': 7,
+            'slug': 'some-slug',
+            'name': 'Some name',
+            'subject': 'Some subject',
+            'project': project_id,
+            'owner': {'id': 1, 'name': 'alice'},
+        },
+        'change': {
+            'user': {'id': 2, 'name': 'bob'},
+            'diff': {},
+        },
+    }
+
+
+class FakeTaiga(object):
+    """A local stand-in for the Taiga API, answering <documents> by path
+    after <delay> seconds, or for another instance of the plugin"""
+
+    def __init__(self, documents, delay=0, port=0):
+        self.documents = documents
+        self.delay = delay
+        self.requests = []
+        self.posts = []
+        self.connections = 0
+        self._sockets = []
+        self._closed = False
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                fake.connections += 1
+                fake._sockets.append(self.request)
+                http.server.BaseHTTPRequestHandler.setup(self)
+
+            def do_GET(self):
+                fake.requests.append(self.path)
+                time.sleep(fake.delay)
+                document = fake.documents.get(self.path)
+                body = json.dumps(document).encode('utf-8')
+                self.send_response(404 if document is None else 200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                fake.posts.append((self.path, self.headers, body))
+                time.sleep(fake.delay)
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'OK')
+
+            def log_message(self, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Requests still running are cut short by close()
+                if not fake._closed:
+                    http.server.ThreadingHTTPServer.handle_error(
+                        self, request, client_address)
+
+        self.server = Server(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def close(self):
+        """Stops the server and closes its kept-alive connections, like a
+        restart does"""
+        self._closed = True
+        self.server.shutdown()
+        self.server.server_close()
+        for sock in self._sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class TaigaApiTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.taiga = FakeTaiga({
+            '/api/v1/projects/1': {'name': 'Example project'},
+            '/api/v1/task-statuses/3': {'name': 'In progress'},
+            '/api/v1/users/5': {'full_name_display': 'Alice A.'},
+            '/api/v1/issue-statuses?project=1': [{'id': 8, 'name': 'New'}],
+        })
+        self.project_url = self.taiga.url + '/project/example'
+        self.api = TaigaApi(ConnectionPool(2, 5), LookupCache(60, 60, 100),
+                            4)
+
+    def tearDown(self):
+        self.api.stop()
+        self.taiga.close()
+        SupyTestCase.tearDown(self)
+
+    def testApiUrl(self):
+        self.assertEqual(api_url('https://example.com/project/x'),
+                         'https://example.com/api/v1')
+        self.assertEqual(api_url('https://example.com/taiga/project/x'),
+                         'https://example.com/taiga/api/v1')
+
+    def testCacheAndKeepAlive(self):
+        self.assertEqual(self.api.project_name(self.project_url, 1).result(),
+                         'Example project')
+        self.assertEqual(
+            self.api.status_name(self.project_url, 'task', 3).result(),
+            'In progress')
+        self.assertEqual(self.api.user_name(self.project_url, 5).result(),
+                         'Alice A.')
+        self.assertEqual(self.api.project_name(self.project_url, 1).result(),
+                         'Example project')
+        self.assertEqual(len(self.taiga.requests), 3)
+        self.assertEqual(self.taiga.connections, 1)
+
+    def testStaleConnections(self):
+        pool = ConnectionPool(4, 5)
+        self.taiga.delay = 0.2
+        url = self.taiga.url + '/api/v1/projects/1'
+        with concurrent.futures.ThreadPoolExecutor(3) as executor:
+            for (status, body) in executor.map(
+                    lambda i: pool.request('GET', url), range(3)):
+                self.assertEqual(status, 200)
+        self.assertEqual(self.taiga.connections, 3)
+
+        # Every idle connection is stale after a restart
+        port = self.taiga.server.server_address[1]
+        self.taiga.close()
+        self.taiga = FakeTaiga(self.taiga.documents, port=port)
+        self.assertEqual(pool.request('GET', url)[0], 200)
+        self.assertEqual(self.taiga.connections, 1)
+
+        # Raises once the server is gone
+        self.taiga.close()
+        self.assertRaises(OSError, pool.request, 'GET', url)
+        pool.close()
+
+    def testNegativeCache(self):
+        for i in range(2):
+            self.assertEqual(
+                self.api.project_name(self.project_url, 2).result(), None)
+        self.assertEqual(len(self.taiga.requests), 1)
+
+    def testCoalescing(self):
+        self.taiga.delay = 0.2
+        futures = [self.api.project_name(self.project_url, 1)
+                   for i in range(5)]
+        self.assertEqual(set(f.result() for f in futures),
+                         set(['Example project']))
+        self.assertEqual(len(self.taiga.requests), 1)
+
+    def testDeadline(self):
+        self.taiga.delay = 0.5
+        future = self.api.project_name(self.project_url, 1)
+        (done, not_done) = concurrent.futures.wait([future], 0.05)
+        self.assertEqual(done, set())
+        # The lookup goes on and is cached for the next announcements
+        self.assertEqual(future.result(), 'Example project')
+
+    def testPrefetch(self):
+        self.api.prefetch(self.project_url, 1)
+        deadline = time.time() + 5
+        while len(self.taiga.requests) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(
+            self.api.status_name(self.project_url, 'issue', 8).result(),
+            'New')
+        self.assertEqual(self.api.project_name(self.project_url, 1).result(),
+                         'Example project')
+        self.assertEqual(len(self.taiga.requests), 4)
+
+
+class PayloadQueueTestCase(SupyTestCase):
+    def testDropNewest(self):
+        handled = []
+        q = PayloadQueue(handled.append, 2, 1, 'newest')
+        self.assertTrue(q.put(1))
+        self.assertTrue(q.put(2))
+        self.assertFalse(q.put(3))
+        self.assertEqual(q.dropped, 1)
+        q.start()
+        q.stop()
+        self.assertEqual(handled, [1, 2])
+
+    def testDropOldest(self):
+        handled = []
+        q = PayloadQueue(handled.append, 2, 1, 'oldest')
+        for i in range(4):
+            self.assertTrue(q.put(i))
+        q.start()
+        q.stop()
+        self.assertEqual(handled, [2, 3])
+
+    def testOrderPerKey(self):
+        handled = collections.defaultdict(list)
+        threads = collections.defaultdict(set)
+
+        def handle(key, i):
+            time.sleep(0.001)
+            handled[key].append(i)
+            threads[key].add(threading.current_thread().name)
+        q = PayloadQueue(handle, 1000, 4, 'newest')
+        q.start()
+        for i in range(50):
+            for key in ('1', '2', '3'):
+                self.assertTrue(q.put(key, i, key=key))
+        q.stop()
+        for key in ('1', '2', '3'):
+            self.assertEqual(handled[key], list(range(50)))
+            self.assertEqual(len(threads[key]), 1)
+
+    def testInline(self):
+        handled = []
+        q = PayloadQueue(handled.append, 2, 0, 'newest')
+        self.assertTrue(q.put(1))
+        self.assertEqual(handled, [1])
+
+
+class OutboundSchedulerTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.sent = []
+        self.scheduler = OutboundScheduler(self.sent.append,
+                                           lambda channel: (0.001, 2, 3))
+
+    def testPriority(self):
+        self.assertTrue(priority('format.issue-created') <
+                        priority('format.task-changed') <
+                        priority('format.wikipage-changed'))
+        self.assertTrue(priority('format.wikipage-deleted') <
+                        priority('format.issue-changed'))
+
+    def testRoundRobinAndPriorities(self):
+        for i in range(3):
+            self.scheduler.send('#a', priority('format.task-changed'),
+                                'a%i' % i)
+        self.scheduler.send('#a', priority('format.issue-created'), 'a!')
+        self.scheduler.send('#b', priority('format.task-changed'), 'b0')
+        self.assertEqual([(m.args[0], m.args[1]) for m in self.sent],
+                         [('#a', 'a0'), ('#a', 'a1'), ('#b', 'b0')])
+        self.assertEqual(self.scheduler.pending('#a'), 2)
+        self.scheduler.stop()
+        self.assertEqual([m.args[1] for m in self.sent[3:]], ['a!', 'a2'])
+
+    def testOverflow(self):
+        for i in range(10):
+            self.scheduler.send('#a', priority('format.task-changed'),
+                                'a%i' % i)
+        self.scheduler.stop()
+        self.assertEqual([m.args[1] for m in self.sent],
+                         ['a0', 'a1', '5 more events suppressed', 'a7',
+                          'a8', 'a9'])
+
+    def testOverflowKeepsPriorities(self):
+        self.scheduler.send('#a', priority('format.task-changed'), 'a0')
+        self.scheduler.send('#a', priority('format.task-changed'), 'a1')
+        self.scheduler.send('#a', priority('format.issue-created'), 'issue')
+        for i in range(5):
+            self.scheduler.send('#a', priority('format.wikipage-changed'),
+                                'wiki%i' % i)
+        self.scheduler.stop()
+        self.assertEqual([m.args[1] for m in self.sent],
+                         ['a0', 'a1', '3 more events suppressed', 'issue',
+                          'wiki3', 'wiki4'])
+
+    def testBatching(self):
+        scheduler = OutboundScheduler(self.sent.append,
+                                      lambda channel: (0.001, 5, 5),
+                                      lambda: 2)
+        scheduler.send_all(['#a', '#b', '#c'],
+                           priority('format.task-changed'), 'same')
+        scheduler.send('#b', priority('format.task-changed'), 'other')
+        self.assertEqual([(m.args[0], m.args[1]) for m in self.sent],
+                         [('#a,#b', 'same'), ('#c', 'same'),
+                          ('#b', 'other')])
+
+
+class AdmissionControlTestCase(SupyTestCase):
+    def testRateLimiter(self):
+        limiter = RateLimiter(10, 2, size=2)
+        self.assertEqual([limiter.check('a') for i in range(2)], [0, 0])
+        self.assertTrue(0 < limiter.check('a') <= 0.1)
+        self.assertEqual(limiter.check('b'), 0)
+        # Forgets the least recently seen key beyond its size
+        limiter.check('c')
+        self.assertEqual(limiter.check('a'), 0)
+        self.assertEqual(RateLimiter(0, 1).check('a'), 0)
+
+    def testAdmit(self):
+        admission = AdmissionControl(100, 2, RateLimiter(0, 1),
+                                     RateLimiter(1, 2))
+        self.assertEqual(admission.admit(101, None, 'c'), ('too-large', None))
+        self.assertEqual(admission.admit(10, None, 'c'), None)
+        self.assertEqual(admission.admit(10, None, 'c'), None)
+        self.assertEqual(admission.admit(10, None, 'd'), ('overloaded', 1))
+        admission.release()
+        admission.release()
+        (reason, retry_after) = admission.admit(10, None, 'c')
+        self.assertEqual(reason, 'rate-limited')
+        self.assertEqual(admission.in_flight, 0)
+
+
+class HashRingTestCase(SupyTestCase):
+    def testRebalancing(self):
+        keys = [str(i) for i in range(1000)]
+        ring = HashRing(['a', 'b', 'c'])
+        owners = dict((key, ring.owner(key)) for key in keys)
+        shares = collections.Counter(owners.values())
+        self.assertTrue(min(shares.values()) > 200, shares)
+
+        # Only the keys of a leaving node move
+        smaller = HashRing(['a', 'b'])
+        for key in keys:
+            if owners[key] != 'c':
+                self.assertEqual(smaller.owner(key), owners[key])
+        # And only keys to a joining node
+        larger = HashRing(['a', 'b', 'c', 'd'])
+        moved = [key for key in keys if larger.owner(key) != owners[key]]
+        self.assertTrue(all(larger.owner(key) == 'd' for key in moved))
+        self.assertTrue(150 < len(moved) < 350)
+        self.assertEqual(HashRing([]).owner('1'), None)
+
+
+class ProfilerTestCase(SupyTestCase):
+    def testOneCallAtATime(self):
+        entered = threading.Barrier(2, timeout=5)
+
+        class Service(object):
+            def handle(self, i):
+                # Both calls run at once
+                entered.wait()
+                return i
+        service = Service()
+        stopped = []
+        profiler = Profiler(2, on_limit=lambda: stopped.append(
+            profiler.stop()))
+        profiler.attach(service, 'handle', count=True)
+        profiler.start()
+        results = []
+        threads = [threading.Thread(
+            target=lambda i=i: results.append(service.handle(i)))
+            for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [0, 1])
+        self.assertEqual((profiler.events, profiler.skipped), (2, 1))
+        self.assertEqual(stopped, [True])
+        self.assertNotIn('handle', service.__dict__)
+        self.assertTrue(any('handle' in name for (name, calls, seconds)
+                            in profiler.top_functions(10)))
+
+
+class SpoolTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def testReplay(self):
+        spool = Spool(self.directory, 100, 10000)
+        for i in range(10):
+            spool.append('net', '#chan%i' % (i % 2), b'body%i' % i)
+        spool.append('net', '#chan0', b'stale', timestamp=time.time() - 60)
+        self.assertTrue(len(os.listdir(self.directory)) > 1)
+        spool.close()
+
+        # Survives a restart, keeps the order
+        spool = Spool(self.directory, 100, 10000)
+        delivered = []
+        def deliver(network, channel, body):
+            if channel == '#chan1':
+                return False
+            delivered.append(body)
+            return True
+        self.assertEqual(spool.replay(deliver, 30), (5, 5, 1))
+        self.assertEqual(delivered, [b'body0', b'body2', b'body4', b'body6',
+                                     b'body8'])
+        self.assertEqual(spool.replay(lambda *args: True), (5, 0, 0))
+        self.assertEqual(spool.size(), 0)
+
+    def testBudget(self):
+        spool = Spool(self.directory, 100, 300)
+        for i in range(50):
+            spool.append('net', '#chan', b'x' * 40)
+        self.assertTrue(spool.size() <= 300 + 100)
+        (delivered, kept, expired) = spool.replay(lambda *args: True)
+        self.assertTrue(0 < delivered < 50)
+
+    def testCorruption(self):
+        spool = Spool(self.directory, 10000, 10000)
+        spool.append('net', '#chan', b'first')
+        spool.append('net', '#chan', b'second')
+        spool.close()
+        (segment,) = os.listdir(self.directory)
+        with open(os.path.join(self.directory, segment), 'r+b') as fd:
+            fd.seek(-2, os.SEEK_END)
+            fd.write(b'XX')
+        spool = Spool(self.directory, 10000, 10000)
+        delivered = []
+        spool.replay(lambda network, channel, body: delivered.append(body) or
+                     True)
+        self.assertEqual(delivered, [b'first'])
+
+    def testFsync(self):
+        fsync = os.fsync
+        synced = []
+        os.fsync = synced.append
+        try:
+            # Segments are synced when they are rotated or closed
+            spool = Spool(self.directory, 100, 10000)
+            for i in range(2):
+                spool.append('net', '#chan', b'x' * 60)
+            self.assertEqual(len(synced), 1)
+            spool.close()
+            self.assertEqual(len(synced), 2)
+
+            # And every record if asked to
+            del synced[:]
+            spool = Spool(self.directory, 100, 10000, fsync=True)
+            spool.append('net', '#chan', b'x')
+            spool.append('net', '#chan', b'y')
+            self.assertEqual(len(synced), 2)
+            spool.close()
+        finally:
+            os.fsync = fsync
+
+
+class SqliteStoreTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'Taiga.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        SupyTestCase.tearDown(self)
+
+    def testStore(self):
+        example = {'slug': 'example', 'url': 'https://x/project/example'}
+        other = {'slug': 'other', 'url': 'https://x/project/other'}
+        store = SqliteStore(self.path)
+        self.assertFalse(store.migrated())
+        store.migrate({'#A': {'1': example}})
+        self.assertTrue(store.migrated())
+        store.save('#b', {'1': example, '2': other})
+        store.save('#c', {'2': other})
+        store.save('#c', {})
+        store.close()
+
+        store = SqliteStore(self.path)
+        self.assertTrue(store.migrated())
+        self.assertEqual(dict(store.load_all()),
+                         {'#a': {'1': example},
+                          '#b': {'1': example, '2': other}})
+        self.assertEqual(store.where(1), [('', '#a', 'example'),
+                                          ('', '#b', 'example')])
+        self.assertEqual(store.where(3), [])
+        store.close()
+
+
+class DedupCacheTestCase(SupyTestCase):
+    def testTtlAndSize(self):
+        cache = DedupCache(60, 2)
+        self.assertFalse(cache.seen('a'))
+        self.assertTrue(cache.seen('a'))
+        self.assertFalse(cache.seen('b'))
+        self.assertFalse(cache.seen('c'))
+        self.assertFalse(cache.seen('a'))
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+        cache.ttl = 0.01
+        time.sleep(0.02)
+        self.assertFalse(cache.seen('c'))
+
+    def testEventKey(self):
+        payload = make_payload()
+        self.assertEqual(DedupCache.event_key(payload), None)
+        payload['date'] = '2026-01-01T00:00:00Z'
+        self.assertEqual(DedupCache.event_key(payload),
+                         ('event', 'userstory', 'create', 42,
+                          '2026-01-01T00:00:00Z'))
+        self.assertEqual(DedupCache.event_key([]), None)
+
+
+class EventTestCase(SupyTestCase):
+    def testFieldExtraction(self):
+        payload = make_payload('userstory', 'change')
+        payload['data']['description'] = 'A long description'
+        payload['data']['unused'] = 'Not referenced'
+        templates = [Template('{userstory[description]}'),
+                     Template('{user[name]}')]
+        (fields, keep_change) = referenced_fields('userstory', templates)
+        self.assertEqual((fields, keep_change), (set(['description']), False))
+        event = EVENT_TYPES['userstory'](payload, fields, keep_change)
+        self.assertEqual(event.data['description'], 'A long description')
+        self.assertNotIn('unused', event.data)
+        self.assertEqual(event.change, None)
+        self.assertEqual(event.user['name'], 'bob')
+        self.assertEqual(event.url('http://x/project/y'),
+                         'http://x/project/y/us/7')
+        self.assertFalse(hasattr(event, '__dict__'))
+
+    def testLoads(self):
+        self.assertEqual(loads(b'{"a": [1]}'), {'a': [1]})
+        self.assertRaises(ValueError, loads, b'{')
+        self.assertRaises(ValueError, loads, b'\xff')
+
+
+class EventFilterTestCase(SupyTestCase):
+    def assertMatches(self, rules, payload, expected=True):
+        diff = payload['change']['diff'] \
+            if payload['action'] == 'change' else {}
+        self.assertEqual(EventFilter(rules).matches(
+            payload['type'], payload['action'], payload['data'], diff),
+            expected)
+
+    def testTypesAndActions(self):
+        self.assertMatches('', make_payload())
+        self.assertMatches('type:task,issue', make_payload('task'))
+        self.assertMatches('type:task,issue', make_payload(), False)
+        self.assertMatches('-action:delete', make_payload('task', 'delete'),
+                           False)
+        self.assertMatches('type:task -action:delete',
+                           make_payload('task', 'change'))
+        for rules in ('type:', 'type:bug', 'colour:red', 'type'):
+            self.assertRaises(ValueError, EventFilter, rules)
+
+    def testChangedTagsAndAssignee(self):
+        payload = make_payload('issue', 'change')
+        payload['change']['diff'] = {'status': {'from': 'New', 'to': 'Done'}}
+        self.assertMatches('changed:status,assigned_to', payload)
+        self.assertMatches('-changed:status', payload, False)
+        # Only restricts changes
+        self.assertMatches('changed:subject', make_payload('issue'))
+
+        payload['data']['tags'] = [['Urgent', '#f00'], 'backend']
+        self.assertMatches('tag:urgent', payload)
+        self.assertMatches('-tag:backend', payload, False)
+
+        self.assertMatches('assignee:none', payload)
+        payload['data']['assigned_to'] = {'id': 5, 'username': 'alice'}
+        self.assertMatches('assignee:Alice', payload)
+        self.assertMatches('assignee:5', payload)
+        self.assertMatches('-assignee:none', payload)
+        payload['data']['assigned_to'] = 6
+        self.assertMatches('assignee:6', payload)
+
 
 class TaigaTestCase(PluginTestCase):
     plugins = ('Taiga',)
 
 
+class BenchmarkTestCase(PluginTestCase):
+    plugins = ('Taiga',)
+
+    def testSmoke(self):
+        plugin = self.irc.getCallback('Taiga')
+        results = run_benchmark(plugin, events=30, channels=5, projects=3,
+                                subscriptions=2)
+        self.assertEqual(results['events'], 30)
+        self.assertTrue(results['messages'] > 0)
+        self.assertEqual(plugin._index.lookup('1000'), [])
+
+        # Timings only fail on a gross slowdown
+        self.assertEqual(compare_baseline(results, results), [])
+        baseline = dict(results, p50_ms=results['p50_ms'] / 1.5,
+                        p99_ms=results['p99_ms'] / 10)
+        self.assertEqual(compare_baseline(results, baseline), [])
+        baseline['events_per_second'] = results['events_per_second'] * 3
+        self.assertEqual(
+            [r.split(':')[0] for r in compare_baseline(results, baseline)],
+            ['events_per_second'])
+
+    if os.environ.get('TAIGA_BENCHMARK'):
+        def testBenchmark(self):
+            plugin = self.irc.getCallback('Taiga')
+            results = run_benchmark(plugin)
+            print('\n' + format_results(results))
+            path = os.path.join(os.path.dirname(__file__),
+                                'bench_baseline.json')
+            if os.environ.get('TAIGA_BENCHMARK_UPDATE'):
+                with open(path, 'w') as fd:
+                    json.dump(results, fd, indent=4, sort_keys=True)
+                return
+            with open(path) as fd:
+                baseline = json.load(fd)
+            print('Timings relative to the baseline: ' +
+                  compare_timings(results, baseline))
+            regressions = compare_baseline(results, baseline)
+            self.assertFalse(regressions, 'Regressed from the baseline: ' +
+                             ', '.join(regressions))
+
+
+class TaigaChannelTestCase(ChannelPluginTestCase):
+    plugins = ('Taiga',)
+
+    def setUp(self):
+        super(TaigaChannelTestCase, self).setUp()
+        self.plugin = self.irc.getCallback('Taiga')
+        self.handler = TaigaHandler(self.plugin, self.irc)
+
+    def tearDown(self):
+        self.handler.stop()
+        self.plugin._save_projects({}, self.channel)
+        super(TaigaChannelTestCase, self).tearDown()
+
+    def _takeAnnouncements(self):
+        msgs = []
+        msg = self.irc.takeMsg()
+        while msg is not None:
+            msgs.append(msg)
+            msg = self.irc.takeMsg()
+        return msgs
+
+    def testIndexFollowsCommands(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self.assertEqual([c for (c, p) in self.plugin._index.lookup(1)],
+                         [self.channel])
+        self.assertNotError('taiga project remove 1')
+        self.assertEqual(self.plugin._index.lookup(1), [])
+
+    def testImportExport(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self.assertResponse(
+            'taiga project import 1,renamed,https://taiga.example.com '
+            '2,other,https://other.example.com/',
+            'Imported 2 projects (1 updated), 2 are announced to %s.' %
+            self.channel)
+        self.assertEqual(sorted(c for (c, p)
+                                in self.plugin._index.lookup('2')),
+                         [self.channel])
+        self.assertResponse('taiga project export --csv',
+                            'id,slug,host 1,renamed,https://taiga.example.com '
+                            '2,other,https://other.example.com')
+        exported = self.getMsg('taiga project export').args[1]
+        self.assertEqual(json.loads(exported)['2'],
+                         {'slug': 'other',
+                          'url': 'https://other.example.com/project/other'})
+
+        self.assertError('taiga project import 3,bad slug')
+        self.assertError('taiga project import x,slug,https://example.com')
+        taiga = FakeTaiga({'/projects.json': {'5': {
+            'slug': 'five',
+            'url': 'https://taiga.example.com/project/five'}}})
+        try:
+            self.assertNotError('taiga project import --replace %s'
+                                '/projects.json' % taiga.url)
+        finally:
+            taiga.close()
+        self.assertEqual(list(self.plugin._load_projects(self.channel)),
+                         ['5'])
+
+    def testList(self):
+        self.plugin._save_projects(dict(
+            (str(i), {'slug': 'project%i' % i,
+                      'url': 'https://%s.example.com/project/project%i' %
+                      ('a' if i % 2 else 'b', i)})
+            for i in range(1, 41)), self.channel)
+        self.assertResponse('taiga project list --host b.example --page 2',
+                            'https://b.example.com: ' +
+                            ', '.join('%i project%i' % (i, i)
+                                      for i in range(22, 41, 2)) +
+                            ' (page 2/2, 20 projects)')
+        self.assertResponse('taiga project list --page 2',
+                            'https://a.example.com: 21 project21, '
+                            '23 project23, 25 project25, 27 project27, '
+                            '29 project29, 31 project31, 33 project33, '
+                            '35 project35, 37 project37, 39 project39 '
+                            '(page 2/4, 40 projects)')
+        self.assertResponse('taiga project list --slug project40',
+                            'https://b.example.com: 40 project40')
+        self.assertError('taiga project list --page 5')
+        self.assertError('taiga project list --slug nope')
+
+    def testWhere(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self.assertResponse('taiga project where 1',
+                            '%s (example)' % self.channel)
+        self.assertError('taiga project where 2')
+
+    def testSqliteStore(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'Taiga.db')
+        try:
+            # The registry is imported when the store is first used
+            self.plugin._store = SqliteStore(path)
+            self.plugin._index.clear()
+            self.plugin._build_index(self.irc)
+            self.assertEqual([c for (c, p) in self.plugin._index.lookup('1')],
+                             [self.channel])
+            self.assertNotError('taiga project add 2 other '
+                                'https://taiga.example.com')
+            self.assertNotError('taiga project remove 1')
+            self.assertResponse('taiga project where 2',
+                                '%s (other)' % self.channel)
+            self.assertEqual(self.plugin._index.lookup('1'), [])
+            # The registry is left alone
+            self.assertEqual(list(self.plugin.registryValue('projects',
+                                                            self.channel)),
+                             ['1'])
+
+            # Loaded again on restart, without importing the registry
+            self.plugin._store.close()
+            self.plugin._store = SqliteStore(path)
+            self.plugin._index.clear()
+            self.plugin._build_index(self.irc)
+            self.assertEqual(list(self.plugin._load_projects(self.channel)),
+                             ['2'])
+            self.assertEqual([c for (c, p) in self.plugin._index.lookup('2')],
+                             [self.channel])
+        finally:
+            if self.plugin._store is not None:
+                self.plugin._store.close()
+            self.plugin._store = None
+            self.plugin._snapshot.clear()
+            self.plugin._index.clear()
+            self.plugin._build_index(self.irc)
+            shutil.rmtree(directory)
+
+    def testIndexFollowsRegistry(self):
+        conf.supybot.plugins.Taiga.projects.get(self.channel).setValue(
+            {'3': {'slug': 'x', 'url': 'http://x/project/x'}})
+        self.assertEqual([c for (c, p) in self.plugin._index.lookup('3')],
+                         [self.channel])
+
+    def testRouting(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        self.handler.handle_payload(make_payload(project_id=1))
+        msgs = self._takeAnnouncements()
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0].args[0], self.channel)
+        self.assertIn('https://taiga.example.com/project/example/us/7',
+                      msgs[0].args[1])
+        self.handler.handle_payload(make_payload(project_id=2))
+        self.assertEqual(self._takeAnnouncements(), [])
+
+    def testDoPost(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        service = self.plugin._service
+        handler = post(service, make_payload(project_id=1))
+        self.assertEqual(handler.response, 200)
+        deadline = time.time() + 5
+        msgs = []
+        while not msgs and time.time() < deadline:
+            time.sleep(0.01)
+            msgs = self._takeAnnouncements()
+        self.assertEqual(len(msgs), 1)
+
+        handler = post(service, make_payload(project_id=1),
+                       headers={'X-TAIGA-WEBHOOK-SIGNATURE': 'nope'})
+        self.assertEqual(handler.response, 403)
+
+    def testInvalidBodies(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        service = self.plugin._service
+        queue = self.plugin._queue
+        (put, queued) = (queue.put, [])
+        queue.put = lambda *args, **kwargs: queued.append(args)
+        try:
+            for body in (b'{not json', b'{not json', b'[1]',
+                         b'{"type": "issue", "data": {}}'):
+                handler = post(service, body)
+                self.assertEqual(handler.response, 400)
+            self.assertEqual(handler.wfile.getvalue(),
+                             b'Error: The notification has no project.')
+            # Taiga's test button
+            handler = post(service, {'type': 'test', 'action': 'test',
+                                     'data': {'test': 'test'}})
+            self.assertEqual(handler.response, 200)
+        finally:
+            queue.put = put
+        self.assertEqual(queued, [])
+        counters = self.plugin._stats.snapshot()['counters']
+        self.assertEqual(counters['invalid'], 4)
+        self.assertNotIn('accepted', counters)
+        self.assertNotIn('duplicates', counters)
+
+    def testStats(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self.plugin._queue.workers = 0
+        try:
+            post(self.plugin._service, make_payload(project_id=1))
+        finally:
+            self.plugin._queue.workers = 2
+        self._takeAnnouncements()
+        self.assertRegexp('taiga stats', 'verify count=1 .*; '
+                          'decode count=1 .*accepted=1')
+        handler = FakeHandler()
+        self.plugin._service.doGet(handler, '/stats')
+        self.assertEqual(handler.response, 200)
+        stats = json.loads(handler.wfile.getvalue().decode('utf-8'))
+        self.assertEqual(stats['counters']['requests'], 1)
+        for stage in ('verify', 'decode', 'route', 'format', 'queue'):
+            self.assertEqual(stats['stages'][stage]['count'], 1)
+        self.assertEqual(stats['dedup'], {'hits': 0, 'misses': 1})
+
+    def testNetworks(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        service = self.plugin._service
+        # Unknown networks and channels without projects are not spooled
+        for path in ('/nonexistent/test', '/test/nonexistent',
+                     '/nonexistent,test/test'):
+            self.assertEqual(post(service, make_payload(), path=path,
+                                  headers={}).response, 404)
+        self.assertEqual(self.plugin._spool.size(), 0)
+        # Nothing is cached for them
+        self.assertNotIn(('#nonexistent', 'verify-signature'),
+                         self.plugin._values._nodes)
+        self.assertIsNone(service.signature_mac('/test/nonexistent'))
+        self.assertNotIn('#nonexistent', self.plugin._macs._macs)
+
+        self.assertEqual(post(service, make_payload(),
+                              path='/test,test/test').response, 200)
+        self.assertEqual(post(service, make_payload(),
+                              path='/*/test').response, 200)
+        dispatcher = self.plugin._dispatcher
+        self.assertEqual([t.irc for t in dispatcher.resolve('*')], [self.irc])
+        self.assertTrue(dispatcher.get('TEST') is dispatcher.get('test'))
+
+    def testCoalesce(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        node = conf.supybot.plugins.Taiga.get('coalesce-window')
+        node.get(self.channel).setValue(60)
+        try:
+            for i in range(3):
+                self.handler.handle_payload(make_payload('userstory',
+                                                         'change'))
+            for i in range(4):
+                payload = make_payload('task', 'create')
+                payload['data']['id'] = i
+                payload['data']['user_story'] = {'id': 9, 'ref': 42}
+                self.handler.handle_payload(payload)
+            self.handler.handle_payload(make_payload('issue', 'create'))
+            self.assertEqual(self._takeAnnouncements(), [])
+            self.handler.coalescer.flush_all()
+            msgs = sorted(m.args[1] for m in self._takeAnnouncements())
+        finally:
+            node.get(self.channel).setValue(0)
+        self.assertEqual(len(msgs), 3)
+        self.assertIn('4 tasks created in US #42 by alice', msgs[0])
+        self.assertIn('Issue \x02#7 Some subject\x02 created by alice',
+                      msgs[1])
+        self.assertIn('Userstory \x02#7 Some subject\x02 changed 3 times '
+                      'by bob', msgs[2])
+
+    def testDuplicateDeliveries(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        payload = make_payload(project_id=1)
+        payload['date'] = '2026-01-01T00:00:00Z'
+        # Announce before answering
+        self.plugin._queue.workers = 0
+        try:
+            for i in range(2):
+                handler = post(self.plugin._service, payload)
+                self.assertEqual(handler.response, 200)
+            body = json.dumps(payload, indent=1).encode('utf-8')
+            self.assertEqual(post(self.plugin._service, body).response, 200)
+        finally:
+            self.plugin._queue.workers = 2
+        self.assertEqual(len(self._takeAnnouncements()), 1)
+
+    def testSpool(self):
+        self.plugin._save_projects({'1': {
+            'slug': 'example',
+            'url': 'https://taiga.example.com/project/example'}}, '#other')
+        self.plugin._queue.workers = 0
+        try:
+            handler = post(self.plugin._service, make_payload(project_id=1),
+                           path='/test/other')
+            self.assertEqual(handler.response, 202)
+            self.assertTrue(self.plugin._spool.size() > 0)
+            self.assertEqual(self._takeAnnouncements(), [])
+
+            self.irc.feedMsg(ircmsgs.join('#other', prefix=self.prefix))
+            self._takeAnnouncements()
+            self.plugin._replay_spool()
+            msgs = self._takeAnnouncements()
+            self.assertEqual([m.args[0] for m in msgs], ['#other'])
+
+            # Replayed notifications are removed from the spool
+            self.plugin._replay_spool()
+            self.assertEqual(self._takeAnnouncements(), [])
+        finally:
+            self.plugin._queue.workers = 2
+            self.plugin._save_projects({}, '#other')
+
+    def testFanOut(self):
+        projects = {'1': {'slug': 'example',
+                          'url': 'https://taiga.example.com/project/example'}}
+        self.plugin._save_projects(projects, self.channel)
+        self.plugin._save_projects(projects, '#other')
+        self.irc.feedMsg(ircmsgs.join('#other', prefix=self.prefix))
+        try:
+            self._takeAnnouncements()
+            # Without ISUPPORT, one PRIVMSG per channel
+            self.handler.handle_payload(make_payload(project_id=1))
+            msgs = self._takeAnnouncements()
+            self.assertEqual(sorted(m.args[0] for m in msgs),
+                             sorted([self.channel, '#other']))
+            self.assertEqual(msgs[0].args[1], msgs[1].args[1])
+            # Rendered once for both channels
+            stats = self.plugin._stats.snapshot()
+            self.assertEqual(stats['stages']['format']['count'], 1)
+
+            self.irc.state.supported['TARGMAX'] = 'NOTICE:,PRIVMSG:4'
+            self.handler.handle_payload(make_payload(project_id=1))
+            msgs = self._takeAnnouncements()
+            self.assertEqual(len(msgs), 1)
+            self.assertEqual(sorted(msgs[0].args[0].split(',')),
+                             sorted([self.channel, '#other']))
+        finally:
+            self.plugin._save_projects({}, '#other')
+
+    def testRenderErrors(self):
+        projects = {'1': {'slug': 'example',
+                          'url': 'https://taiga.example.com/project/example'}}
+        self.plugin._save_projects(projects, self.channel)
+        self.plugin._save_projects(projects, '#other')
+        self.irc.feedMsg(ircmsgs.join('#other', prefix=self.prefix))
+        node = conf.supybot.plugins.Taiga.format.get('userstory-created')
+        original = node.get('#other')()
+        node.get('#other').setValue('{userstory[missing]}')
+        try:
+            self._takeAnnouncements()
+            # The other channel's template does not stop this one
+            self.handler.handle_payload(make_payload(project_id=1))
+            msgs = self._takeAnnouncements()
+            self.assertEqual([m.args[0] for m in msgs], [self.channel])
+            stats = self.plugin._stats.snapshot()
+            self.assertEqual(stats['counters']['unrendered'], 1)
+        finally:
+            node.get('#other').setValue(original)
+            self.plugin._save_projects({}, '#other')
+
+    def testEnrichment(self):
+        taiga = FakeTaiga({
+            '/api/v1/projects/1': {'name': 'Example project'},
+            '/api/v1/users/5': {'full_name_display': 'Alice A.'},
+        })
+        self.plugin._api = TaigaApi(ConnectionPool(2, 5),
+                                    LookupCache(60, 60, 100), 2)
+        node = conf.supybot.plugins.Taiga.format.get('task-created')
+        try:
+            node.get(self.channel).setValue(
+                '[{project[name]}] {task[subject]} for {task[assigned_to]}')
+            self.assertNotError('taiga project add 1 example ' + taiga.url)
+            self._takeAnnouncements()
+            payload = make_payload('task', 'create')
+            payload['data']['assigned_to'] = 5
+            self.handler.handle_payload(payload)
+            msgs = self._takeAnnouncements()
+            self.assertEqual([m.args[1] for m in msgs],
+                             ['[Example project] Some subject for '
+                              'Alice A.'])
+
+            # Announced without the names past the deadline
+            taiga.delay = 1
+            payload['data']['assigned_to'] = 6
+            with conf.supybot.plugins.Taiga.enrich.deadline.context(0.05):
+                self.handler.handle_payload(payload)
+            msgs = self._takeAnnouncements()
+            self.assertEqual([m.args[1] for m in msgs],
+                             ['[Example project] Some subject for 6'])
+        finally:
+            node.get(self.channel).setValue(node())
+            self.plugin._api.stop()
+            self.plugin._api = None
+            taiga.close()
+
+    def testFilter(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        node = conf.supybot.plugins.Taiga.get('filter')
+        self.assertRaises(registry.InvalidRegistryValue,
+                          node.get(self.channel).setValue, 'type:bug')
+        node.get(self.channel).setValue('type:issue -action:delete')
+        try:
+            self.handler.handle_payload(make_payload('userstory'))
+            self.handler.handle_payload(make_payload('issue', 'delete'))
+            self.assertEqual(self._takeAnnouncements(), [])
+            self.assertEqual(
+                self.plugin._stats.snapshot()['counters']['filtered'], 2)
+            self.handler.handle_payload(make_payload('issue'))
+            self.assertEqual(len(self._takeAnnouncements()), 1)
+        finally:
+            node.get(self.channel).setValue('')
+        self.handler.handle_payload(make_payload('userstory'))
+        self.assertEqual(len(self._takeAnnouncements()), 1)
+
+    def testAsyncReceiver(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        receiver = AsyncReceiver(self.plugin._service, '127.0.0.1', 0, 10, 5)
+        receiver.start()
+        self.plugin._queue.workers = 0
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1',
+                                                    receiver.port, timeout=5)
+            # Several requests on a kept-alive connection
+            for (i, path) in enumerate(('/taiga/test/test', '/test/test')):
+                payload = make_payload(project_id=1)
+                payload['data']['id'] = i
+                body = json.dumps(payload).encode('utf-8')
+                connection.request('POST', path, body, {
+                    'X-TAIGA-WEBHOOK-SIGNATURE': sign(body)})
+                response = connection.getresponse()
+                self.assertEqual((response.status, response.read()),
+                                 (200, b'OK'))
+                self.assertFalse(response.will_close)
+            self.assertEqual(len(self._takeAnnouncements()), 2)
+
+            connection.request('POST', '/taiga/test/test', b'{}',
+                               {'X-TAIGA-WEBHOOK-SIGNATURE': 'nope'})
+            self.assertEqual(connection.getresponse().read(),
+                             b'Error: Invalid signature.')
+            connection.request('GET', '/taiga/stats')
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(json.loads(response.read().decode('utf-8'))
+                             ['counters']['accepted'], 2)
+            connection.request('GET', '/')
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual(response.status, 405)
+
+            # Rejected before the body is read
+            connection.putrequest('POST', '/taiga/test/test')
+            connection.putheader('Content-Length', str(100 * 1024 * 1024))
+            connection.endheaders()
+            response = connection.getresponse()
+            self.assertEqual(response.status, 413)
+            self.assertTrue(response.will_close)
+            connection.close()
+
+            # Header lines are bounded before the admission control applies
+            connection = http.client.HTTPConnection('127.0.0.1',
+                                                    receiver.port, timeout=5)
+            connection.putrequest('POST', '/taiga/test/test')
+            for i in range(200):
+                connection.putheader('X-Padding-%i' % i, 'x')
+            connection.endheaders()
+            response = connection.getresponse()
+            self.assertEqual(response.status, 431)
+            self.assertTrue(response.will_close)
+            connection.close()
+
+            # A payload handled inline does not hold up the event loop
+            queue = self.plugin._queue
+            function = queue.function
+            def slow(*args):
+                time.sleep(1)
+                function(*args)
+            queue.function = slow
+            try:
+                body = json.dumps(make_payload(project_id=1)).encode('utf-8')
+                slow_connection = http.client.HTTPConnection(
+                    '127.0.0.1', receiver.port, timeout=5)
+                slow_connection.request('POST', '/taiga/test/test', body, {
+                    'X-TAIGA-WEBHOOK-SIGNATURE': sign(body)})
+                time.sleep(0.1)
+                start = time.time()
+                connection = http.client.HTTPConnection('127.0.0.1',
+                                                        receiver.port,
+                                                        timeout=5)
+                connection.request('GET', '/taiga/stats')
+                self.assertEqual(connection.getresponse().status, 200)
+                self.assertLess(time.time() - start, 0.5)
+                connection.close()
+                self.assertEqual(slow_connection.getresponse().status, 200)
+                slow_connection.close()
+            finally:
+                queue.function = function
+            self.assertEqual(len(self._takeAnnouncements()), 1)
+        finally:
+            self.plugin._queue.workers = 2
+            receiver.stop()
+
+    def testAdmissionControl(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        service = self.plugin._service
+        admission = self.plugin._admission
+        # The defaults accept a bulk change of an item per queue slot from a
+        # Taiga instance to a channel
+        for i in range(self.plugin.registryValue('queue.size')):
+            self.assertIsNone(admission.admit(1000, '192.0.2.1',
+                                              ('test', '#test')))
+            admission.release()
+        self.plugin._admission = AdmissionControl(
+            1000, 1, RateLimiter(0, 1), RateLimiter(0.01, 2))
+        self.plugin._queue.workers = 0
+        try:
+            body = json.dumps(make_payload(project_id=1)).encode('utf-8')
+            handler = post(service, body, headers={
+                'Content-Length': '2000',
+                'X-TAIGA-WEBHOOK-SIGNATURE': sign(body)})
+            self.assertEqual(handler.response, 413)
+
+            # A request is in flight
+            self.assertTrue(service.admit(FakeHandler(), '/test/other'))
+            handler = post(service, body)
+            self.assertEqual((handler.response,
+                              handler.sent_headers.get('Retry-After')),
+                             (503, 1))
+            service.release()
+
+            # Answers once, even if the signature is wrong
+            handler = post(service, body,
+                           headers={'X-TAIGA-WEBHOOK-SIGNATURE': 'nope'})
+            self.assertEqual(handler.response, 403)
+            self.assertEqual(handler.wfile.getvalue(),
+                             b'Error: Invalid signature.')
+            self.assertEqual(post(service, body).response, 200)
+            handler = post(service, body)
+            self.assertEqual((handler.response,
+                              handler.sent_headers.get('Retry-After')),
+                             (429, 100))
+            self.assertEqual(
+                self.plugin._stats.snapshot()['counters']['rate-limited'], 1)
+        finally:
+            self.plugin._admission = admission
+            self.plugin._queue.workers = 2
+
+    def testSignatures(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        service = self.plugin._service
+        group = conf.supybot.plugins.Taiga
+        body = json.dumps(make_payload(project_id=1)).encode('utf-8')
+        self.plugin._queue.workers = 0
+        try:
+            self.assertEqual(post(service, body).response, 200)
+            group.get('secret-key').get(self.channel).setValue('other')
+            self.assertEqual(post(service, body).response, 403)
+            self.assertEqual(post(service, body, headers={
+                'X-TAIGA-WEBHOOK-SIGNATURE': sign(body, 'other')}).response,
+                200)
+
+            group.get('signature-digest').get(self.channel).setValue(
+                'sha256')
+            headers = {'X-TAIGA-WEBHOOK-SIGNATURE': hmac.new(
+                b'other', body, hashlib.sha256).hexdigest()}
+            self.assertEqual(post(service, body, headers=headers).response,
+                             200)
+            self.assertEqual(post(service, body, headers={
+                'X-TAIGA-WEBHOOK-SIGNATURE': '\xe9t\xe9'}).response, 403)
+
+            # Computed as the body arrives
+            mac = service.signature_mac('/test/test')
+            mac.update(body)
+            handler = FakeHandler(headers)
+            service.receive(handler, '/test/test', body, mac)
+            self.assertEqual(handler.response, 200)
+            # Other channels keep their digest
+            self.plugin._save_projects({'1': {
+                'slug': 'example', 'url': 'https://taiga.example.com'}},
+                '#other')
+            self.assertEqual(service.signature_mac('/test/other').digest_size,
+                             hashlib.sha1().digest_size)
+        finally:
+            self.plugin._save_projects({}, '#other')
+            self.plugin._queue.workers = 2
+            group.get('secret-key').get(self.channel).setValue('XXXXXXXX')
+            group.get('signature-digest').get(self.channel).setValue('sha1')
+
+    def testSharding(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        peer = FakeTaiga({'/taiga/stats': {}})
+        group = conf.supybot.plugins.Taiga.shard
+        service = self.plugin._service
+        self.plugin._queue.workers = 0
+        group.get('self').setValue('http://localhost/taiga/')
+        try:
+            # Not shared without a secret
+            group.peers.setValue(['http://localhost/taiga',
+                                  peer.url + '/taiga'])
+            self.assertIsNone(self.plugin._shard)
+            group.secret.setValue('shared')
+            group.peers.setValue(['http://localhost/taiga',
+                                  peer.url + '/taiga'])
+            shard = self.plugin._shard
+            # The peer's view
+            other = ShardRouter(peer.url + '/taiga', ['http://localhost/taiga'],
+                                None, 'shared')
+            ids = dict((shard.owner(i), i) for i in range(100))
+            payload = make_payload(project_id=ids[peer.url + '/taiga'])
+            body = json.dumps(payload).encode('utf-8')
+            self.plugin._save_projects(dict(
+                (str(project_id), {'slug': 'example',
+                                   'url': 'https://x/project/example'})
+                for project_id in ids.values()), self.channel)
+
+            # Forwarded to the owner
+            handler = post(service, body)
+            self.assertEqual((handler.response, handler.wfile.getvalue()),
+                             (200, b'OK'))
+            self.assertEqual(self._takeAnnouncements(), [])
+            (path, headers, forwarded) = peer.posts[0]
+            self.assertEqual((path, forwarded), ('/taiga/test/test', body))
+            self.assertEqual(headers['X-TAIGA-WEBHOOK-SIGNATURE'], sign(body))
+            self.assertEqual(other.verify(headers[FORWARDED_HEADER],
+                                          '/test/test'),
+                             'http://localhost/taiga')
+            self.assertIsNone(other.verify(headers[FORWARDED_HEADER],
+                                           '/test/other'))
+
+            # Announced here when the owner is this instance, or was
+            # forwarded by another one
+            post(service, make_payload(project_id=ids[None]))
+            self.assertEqual(len(self._takeAnnouncements()), 1)
+            payload['data']['id'] = 1
+            body = json.dumps(payload).encode('utf-8')
+            post(service, body, headers={
+                'X-TAIGA-WEBHOOK-SIGNATURE': sign(body),
+                FORWARDED_HEADER: other.sign('/test/test')})
+            self.assertEqual(len(self._takeAnnouncements()), 1)
+            self.assertEqual(len(peer.posts), 1)
+            # Unless the header is not authentic
+            payload['data']['id'] = 3
+            body = json.dumps(payload).encode('utf-8')
+            for forwarded_by in (peer.url + '/taiga',
+                                 other.sign('/test/test')[:-1] + 'x'):
+                post(service, body, headers={
+                    'X-TAIGA-WEBHOOK-SIGNATURE': sign(body),
+                    FORWARDED_HEADER: forwarded_by})
+            self.assertEqual(self._takeAnnouncements(), [])
+            self.assertEqual(len(peer.posts), 3)
+
+            # The asyncio receiver keeps serving while a forward waits
+            receiver = AsyncReceiver(service, '127.0.0.1', 0, 10, 5)
+            receiver.start()
+            peer.delay = 1
+            try:
+                def forward():
+                    connection = http.client.HTTPConnection(
+                        '127.0.0.1', receiver.port, timeout=5)
+                    connection.request('POST', '/taiga/test/test', body, {
+                        'X-TAIGA-WEBHOOK-SIGNATURE': sign(body)})
+                    responses.append(connection.getresponse().status)
+                    connection.close()
+                responses = []
+                thread = threading.Thread(target=forward)
+                thread.start()
+                time.sleep(0.2)
+                start = time.time()
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', receiver.port, timeout=5)
+                connection.request('GET', '/taiga/stats')
+                self.assertEqual(connection.getresponse().status, 200)
+                self.assertLess(time.time() - start, 0.5)
+                connection.close()
+                thread.join()
+                self.assertEqual(responses, [200])
+                self.assertEqual(len(peer.posts), 4)
+            finally:
+                peer.delay = 0
+                receiver.stop()
+
+            # Taken over while the owner does not answer
+            peer.close()
+            payload['data']['id'] = 2
+            self.assertEqual(post(service, payload).response, 200)
+            self.assertEqual(len(self._takeAnnouncements()), 1)
+            self.assertEqual(shard.alive(), ['http://localhost/taiga'])
+            self.assertEqual(len(peer.posts), 4)
+
+            # And back once it does
+            peer = FakeTaiga({'/taiga/stats': {}})
+            group.peers.setValue(['http://localhost/taiga',
+                                  peer.url + '/taiga'])
+            shard._down.add(peer.url + '/taiga')
+            shard._rebuild()
+            self.assertTrue(self.plugin._shard is shard)
+            shard._check()
+            self.assertEqual(len(shard.alive()), 2)
+        finally:
+            self.plugin._queue.workers = 2
+            group.peers.setValue([])
+            group.get('self').setValue('')
+            group.secret.setValue('')
+            peer.close()
+        self.assertEqual(self.plugin._shard, None)
+
+    def testProfile(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        service = self.plugin._service
+        queue = self.plugin._queue
+        self.assertError('taiga profile stop')
+        self.assertError('taiga profile dump')
+        queue.workers = 0
+        try:
+            self.assertNotError('taiga profile start --events 2 --memory')
+            self.assertError('taiga profile start')
+            self.assertIn('receive', service.__dict__)
+            for i in range(3):
+                payload = make_payload(project_id=1)
+                payload['data']['id'] = i
+                post(service, payload)
+            self.assertEqual(len(self._takeAnnouncements()), 3)
+            # Stopped after the second notification
+            self.assertEqual(self.plugin._profiler.events, 2)
+            self.assertNotIn('receive', service.__dict__)
+            self.assertEqual(queue.function, service.process)
+            self.assertRegexp('taiga profile dump',
+                              r'Profiled 2 notifications, written to '
+                              r'.*\.prof and .*\.allocations\. '
+                              r'Top functions: .*\. Top allocations: ')
+
+            self.assertNotError('taiga profile start')
+            self.assertIsNotNone(self.plugin._profile_event)
+            self.assertRegexp('taiga profile stop', 'Profiled 0 notifications')
+            self.assertIsNone(self.plugin._profile_event)
+            self.assertError('taiga profile stop')
+        finally:
+            queue.workers = 2
+            self.plugin._stop_profile()
+            for path in glob.glob(conf.supybot.directories.data.dirize(
+                    'Taiga-profile-*')):
+                os.remove(path)
+
+    def testFormatValidation(self):
+        node = conf.supybot.plugins.Taiga.format.get('task-created')
+        changed = conf.supybot.plugins.Taiga.format.get('task-changed')
+        original = node()
+        original_changed = changed()
+        try:
+            for invalid in ('{nope}', '{task[ref]', '{0}', '{}',
+                            '{userstory[ref]}', '{change[diff]}', '{url!x}',
+                            '{url:d!}', '{url:q}'):
+                self.assertRaises(registry.InvalidRegistryValue,
+                                  node.setValue, invalid)
+            self.assertEqual(node(), original)
+            node.setValue('{task[ref]:>5} {url!r} {project[name]}')
+            changed.setValue('{task[ref]} {change[diff]}')
+        finally:
+            node.setValue(original)
+            changed.setValue(original_changed)
+
+    def testFormatCacheInvalidation(self):
+        self.assertNotError('taiga project add 1 example '
+                            'https://taiga.example.com')
+        self._takeAnnouncements()
+        node = conf.supybot.plugins.Taiga.format.get('userstory-created')
+        original = node()
+        try:
+            self.handler.handle_payload(make_payload(project_id=1))
+            self.assertIn('Some subject', self._takeAnnouncements()[0].args[1])
+            node.setValue('#{userstory[ref]} by {user[name]}')
+            self.handler.handle_payload(make_payload(project_id=1))
+            self.assertEqual(self._takeAnnouncements()[0].args[1],
+                             '#7 by alice')
+        finally:
+            node.setValue(original)
+
+
 # vim:set shiftwidth=4 tabstop=4 expandtab textwidth=79: